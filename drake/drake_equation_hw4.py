@@ -5,7 +5,8 @@ Homework 4: The Drake Equation
 
 from drv import DRV
 
-def main():
+def drake_factors():
+    """ The factors of the Drake equation, in order, by name """
     # Star formation rate: Given distribution between 1.5 and 3.0 represented as a uniform distribution
     R_star = DRV(dist_type='uniform', min_val=1.5, max_val=3.0,
                  bins=20)
@@ -43,6 +44,12 @@ def main():
     L = DRV({1000: 0.1, 10000: 0.4, 100000: 0.3,
              1000000: 0.2})
 
+    return {'R_star': R_star, 'f_p': f_p, 'n_e': n_e, 'f_l': f_l, 'f_i': f_i, 'f_c': f_c, 'L': L}
+
+
+def main():
+    R_star, f_p, n_e, f_l, f_i, f_c, L = drake_factors().values()
+
     # Drake equation: multiplies all of the above factors
     N = R_star * f_p * n_e * f_l * f_i * f_c * L
 
@@ -61,7 +68,17 @@ if __name__ == '__main__':
 
 """
 The expected number of intelligent civilizations
-based on the Drake equation is 79376.414
+based on the Drake equation is 9710.871
+
+The standard deviation is 23913.253
+
+(Earlier runs reported 79376.414 and 243536.628: DRV.apply used to add a
+repeated outcome's probability twice, so N's probabilities summed to ~10.9.)
+
+N has 2081 distinct outcomes, but only 1308 once outcomes that differ by
+float error are merged (DRV rtol=1e-12 or digits=12 on the factors).
 
-The standard deviation is 243536.628
+Pinning each factor to its 10th/90th percentile (python drv_sensitivity.py),
+L moves E[N] the most (41.5 to 41481.7), then n_e, f_i, f_c, f_l and R_star;
+f_p is fixed at 1 and does not move it.
 """
\ No newline at end of file
@@ -5,17 +5,31 @@ To be imported into HW4
 '''
 
 
-import copy
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
 import random
+from types import MappingProxyType
 
 class DRV:
     """ A model for discrete random variables where outcomes are numeric """
 
-    def __init__(self, dist=None, dist_type='discrete', min_val=None, max_val=None, mean=None, stdev=None, bins=None):
-        """ Constructor """
+    BINNINGS = ('equal_width', 'quantile', 'log')
+
+    def __init__(self, dist=None, dist_type='discrete', min_val=None, max_val=None, mean=None, stdev=None, bins=None,
+                 max_support=None, binning='equal_width', rtol=None, digits=None):
+        """ Constructor; outcomes are kept as sorted value/probability arrays.
+        With rtol or digits set, results of arithmetic on this DRV merge
+        outcomes that only differ by float error (see canonicalize); with
+        max_support set they are rebinned to at most that many outcomes
+        (see rebin) """
+        if max_support is not None and max_support < 2:
+            raise ValueError(f"max_support must be at least 2 to keep the variance, not {max_support}")
+        self._changed()
+        self.max_support = max_support
+        self.binning = binning
+        self.rtol = rtol
+        self.digits = digits
         self.dist_type = dist_type
         self.min_val = min_val
         self.max_val = max_val
@@ -24,12 +38,57 @@ class DRV:
         self.bins = bins
 
         if dist_type == 'discrete':
-            self.dist = copy.deepcopy(dist) if dist is not None else {}
+            # the setter copies the outcomes into arrays
+            self.dist = dist if dist is not None else {}
         elif dist_type == 'uniform':
             self.dist = self._create_uniform_distribution(min_val, max_val, bins)
         elif dist_type == 'normal':
             self.dist = self._create_normal_distribution(mean, stdev, bins)
 
+    @staticmethod
+    def from_arrays(values, probs):
+        """ Build a discrete DRV from parallel value/probability arrays,
+        merging equal values """
+        values = np.asarray(values, dtype=float).ravel()
+        probs = np.asarray(probs, dtype=float).ravel()
+        Z = DRV()
+        # np.unique sorts the outcomes; bincount sums the probability of duplicates
+        Z.values, inverse = np.unique(values, return_inverse=True)
+        Z.probs = np.bincount(inverse.ravel(), weights=probs, minlength=len(Z.values))
+        return Z
+
+    @property
+    def dist(self):
+        """ The distribution as a read-only {outcome: probability} mapping, built on
+        demand; change outcomes with X[x] = p or by assigning a whole new dist """
+        if self._dist is None:
+            self._dist = dict(zip(self.values.tolist(), self.probs.tolist()))
+        # the cache stays a plain dict so a DRV still pickles (MappingProxyType does not)
+        return MappingProxyType(self._dist)
+
+    @dist.setter
+    def dist(self, dist):
+        values = np.fromiter(dist.keys(), dtype=float, count=len(dist))
+        probs = np.fromiter(dist.values(), dtype=float, count=len(dist))
+        order = np.argsort(values, kind='stable')
+        self.values = values[order]
+        self.probs = probs[order]
+        self._changed()
+
+    def _changed(self):
+        """ Drop everything cached from the outcomes after they change """
+        self._dist = None
+        self._alias = None
+        self._cumulative = None
+        self._moments = None
+        self._step = None
+
+    def __getstate__(self):
+        """ Pickle/copy without the caches rebuilt on demand from the outcomes """
+        state = self.__dict__.copy()
+        state.update(_dist=None, _alias=None, _cumulative=None, _step=None)
+        return state
+
     def _create_uniform_distribution(self, min_val, max_val, bins):
         step = (max_val - min_val) / bins
         dist = {min_val + i * step: 1 / bins for i in range(bins)}
@@ -38,53 +97,301 @@ class DRV:
     def _create_normal_distribution(self, mean, stdev, bins):
         x = np.linspace(mean - 3 * stdev, mean + 3 * stdev, bins)
         pdf = 1 / (stdev * np.sqrt(2 * np.pi)) * np.exp(-0.5 * ((x - mean) / stdev) ** 2)
-        pdf /= pdf.sum() * (x[1] - x[0])  # Normalize so that the sum of probabilities equals 1
+        pdf /= pdf.sum()  # Normalize so that the sum of probabilities equals 1
         dist = {x[i]: pdf[i] for i in range(bins)}
         return dist
 
     def __getitem__(self, x):
-        return self.dist.get(x, 0.0)
+        i = np.searchsorted(self.values, x)
+        if i < len(self.values) and self.values[i] == x:
+            return self.probs[i]
+        return 0.0
 
     def __setitem__(self, x, p):
-        if x in self.dist:
-            self.dist[x] += p
+        """ Set the probability of outcome x; X[x] += p adds to it """
+        i = np.searchsorted(self.values, x)
+        if i < len(self.values) and self.values[i] == x:
+            self.probs[i] = p
         else:
-            self.dist[x] = p
+            self.values = np.insert(self.values, i, x)
+            self.probs = np.insert(self.probs, i, p)
+        self._changed()
 
-    def apply(self, other, op):
-        """ Apply a binary operator to self and other """
-        Z = DRV()
-        items = self.dist.items()
-        oitems = other.dist.items()
-        for x, px in items:
-            for y, py in oitems:
-                Z[op(x, y)] += px * py
+    @staticmethod
+    def _outer(op, x, y):
+        """ op over every (x, y) pair as a matrix, in one call when op broadcasts """
+        try:
+            z = np.asarray(op(x[:, None], y[None, :]), dtype=float)
+            if z.shape == (len(x), len(y)):
+                return z
+        except (TypeError, ValueError):
+            pass
+        return np.frompyfunc(op, 2, 1).outer(x, y).astype(float)
+
+    def _bin_index(self, nbins, binning):
+        """ Bin number of every outcome; non-decreasing since values are sorted """
+        x, p = self.values, self.probs
+        if binning == 'quantile':
+            # each outcome goes to the bin holding the midpoint of its probability mass
+            mid = (np.cumsum(p) - p / 2) / p.sum()
+            return np.minimum((mid * nbins).astype(int), nbins - 1)
+        if binning == 'log' and x[0] > 0:
+            edges = np.geomspace(x[0], x[-1], nbins + 1)
+        else:
+            # equal width, also the fallback for log binning of non-positive outcomes
+            edges = np.linspace(x[0], x[-1], nbins + 1)
+        return np.clip(np.searchsorted(edges, x, side='right') - 1, 0, nbins - 1)
+
+    def rebin(self, max_support=None, binning=None):
+        """ Compact to at most max_support outcomes, keeping mean and variance.
+        Outcomes are grouped into max_support // 2 bins and each bin is replaced
+        by two points inside it with the bin's mass, mean and variance: its
+        lowest outcome a and m + v / (m - a), so max_support must be at least 2 """
+        max_support = self.max_support if max_support is None else max_support
+        binning = self.binning if binning is None else binning
+        if binning not in DRV.BINNINGS:
+            raise ValueError(f"binning must be one of {DRV.BINNINGS}, not {binning!r}")
+        if max_support is not None and max_support < 2:
+            raise ValueError(f"max_support must be at least 2 to keep the variance, not {max_support}")
+
+        keep = self.probs > 0
+        Z = DRV.from_arrays(self.values[keep], self.probs[keep])
+        if max_support is not None and len(Z.values) > max_support:
+            x, p = Z.values, Z.probs
+            # bins are runs of consecutive outcomes; seg maps each outcome to its run
+            _, starts, seg = np.unique(Z._bin_index(max_support // 2, binning),
+                                       return_index=True, return_inverse=True)
+
+            w = np.add.reduceat(p, starts)
+            m = np.add.reduceat(p * x, starts) / w
+            v = np.add.reduceat(p * (x - m[seg]) ** 2, starts) / w
+            a = x[starts]
+
+            # a bin with no spread collapses to its mean
+            spread = (v > 0) & (m > a)
+            gap = np.where(spread, m - a, 1)
+            hi = np.where(spread, m + v / gap, m)
+            q = np.where(spread, gap / np.where(spread, hi - a, 1), 1.0)
+            values = np.concatenate([a, hi])
+            probs = np.concatenate([w * (1 - q), w * q])
+            Z = DRV.from_arrays(values[probs > 0], probs[probs > 0])
+
+        Z.max_support = max_support
+        Z.binning = binning
+        Z.rtol = self.rtol
+        Z.digits = self.digits
         return Z
 
-    def applyscalar(self, a, op):
-        Z = DRV()
-        items = self.dist.items()
-        for x, p in items:
-            Z[op(x,a)] += p
+    def canonicalize(self, rtol=None, digits=None):
+        """ Merge outcomes that are the same number up to float error, e.g.
+        0.1*0.2*0.3 and 0.3*0.2*0.1. digits rounds every outcome to that many
+        significant digits; rtol then joins each run of outcomes less than
+        rtol apart (relative to the larger one) into its probability-weighted
+        mean, which keeps the mean of the DRV """
+        x, p = self.values, self.probs
+        if digits is not None:
+            magnitude = np.floor(np.log10(np.abs(np.where(x == 0, 1, x))))
+            scale = 10.0 ** (digits - 1 - magnitude)
+            Z = DRV.from_arrays(np.round(x * scale) / scale, p)
+            x, p = Z.values, Z.probs
+        if rtol is not None and len(x) > 1:
+            apart = np.diff(x) > rtol * np.maximum(np.abs(x[1:]), np.abs(x[:-1]))
+            starts = np.flatnonzero(np.concatenate([[True], apart]))
+            w = np.add.reduceat(p, starts)
+            means = np.add.reduceat(p * x, starts) / np.where(w > 0, w, 1)
+            x, p = np.where(w > 0, means, x[starts]), w
+
+        Z = DRV.from_arrays(x, p)
+        Z.max_support = self.max_support
+        Z.binning = self.binning
+        Z.rtol = rtol
+        Z.digits = digits
+        return Z
+
+    def _compact(self, *sources):
+        """ Canonicalize and rebin a freshly computed result under the policies
+        of the DRVs it came from; for each setting the first that has it wins """
+        def first(name):
+            return next((getattr(s, name) for s in sources if getattr(s, name) is not None), None)
+
+        rtol, digits = first('rtol'), first('digits')
+        Z = self
+        if rtol is not None or digits is not None:
+            Z = Z.canonicalize(rtol, digits)
+        policy = next((s for s in sources if s.max_support is not None), None)
+        if policy is not None:
+            Z = Z.rebin(policy.max_support, policy.binning)
+        Z.rtol = rtol
+        Z.digits = digits
+        return Z
+
+    def apply(self, other, op, moments=None):
+        """ Apply a binary operator to self and other. moments, if given, maps
+        the (mean, variance) of both operands to those of the result """
+        if not isinstance(other, DRV):
+            # lets the other operand (e.g. a LazyDRV) handle the operator
+            return NotImplemented
+        values = DRV._outer(op, self.values, other.values)
+        probs = np.outer(self.probs, other.probs)
+        Z = DRV.from_arrays(values, probs)._compact(self, other)
+        if moments is not None:
+            Z._moments = moments(self.moments(), other.moments())
+        return Z
+
+    def applyscalar(self, a, op, moments=None):
+        values = DRV._outer(op, self.values, np.array([a], dtype=float))
+        Z = DRV.from_arrays(values, self.probs)._compact(self)
+        if moments is not None:
+            Z._moments = moments(self.moments(), a)
+        return Z
+
+    @staticmethod
+    def fft_product(factors, points=4096, exact=False):
+        """ Distribution of the product of independent non-negative DRVs,
+        computed in the log domain: every factor is put on a shared log-spaced
+        grid, so the product is a sum of grid indices and the whole chain is
+        one FFT convolution. Returns (product, errors) where errors holds the
+        relative error of the mean and stdev against the exact moments, and
+        with exact=True also the Wasserstein-1 distance to the exact product
+        (the area between the two CDFs) relative to its mean """
+        factors = list(factors)
+        if any(f.values[0] < 0 for f in factors):
+            raise ValueError("fft_product needs non-negative factors")
+
+        # a product is 0 when any factor is; the grid only carries the positive part
+        positive = [f.values > 0 for f in factors]
+        p_zero = 1 - np.prod([f.probs[pos].sum() for f, pos in zip(factors, positive)])
+        if not all(pos.any() for pos in positive):
+            return DRV({0.0: 1.0}), {'mean': 0.0, 'stdev': 0.0}
+        logs = [np.log(f.values[pos]) for f, pos in zip(factors, positive)]
+        probs = [f.probs[pos] / f.probs[pos].sum() for f, pos in zip(factors, positive)]
+
+        spans = [u[-1] - u[0] for u in logs]
+        h = sum(spans) / points if sum(spans) > 0 else 1.0
+
+        nfft = 1
+        length = sum(int(span / h) + 2 for span in spans) - len(factors) + 1
+        while nfft < length:
+            nfft *= 2
+        spectrum = np.ones(nfft // 2 + 1, dtype=complex)
+        for u, p, span in zip(logs, probs, spans):
+            size = int(span / h) + 2
+            # split each outcome between its two neighbouring grid points so
+            # that the factor's mean is kept exactly
+            j = np.minimum(((u - u[0]) / h).astype(int), size - 2)
+            lo, hi = np.exp(u[0] + j * h), np.exp(u[0] + (j + 1) * h)
+            w = (np.exp(u) - lo) / (hi - lo)
+            grid = np.bincount(j, p * (1 - w), size) + np.bincount(j + 1, p * w, size)
+            spectrum *= np.fft.rfft(grid, nfft)
+
+        grid = np.fft.irfft(spectrum, nfft)[:length]
+        grid[grid < 1e-13 * grid.max()] = 0
+        values = np.exp(sum(u[0] for u in logs) + h * np.arange(length))
+        Z = DRV.from_arrays(np.append(values, 0.0), np.append(grid / grid.sum() * (1 - p_zero), p_zero))
+        Z = DRV.from_arrays(Z.values[Z.probs > 0], Z.probs[Z.probs > 0])
+
+        mean = np.prod([f.expected_value() for f in factors])
+        stdev = np.sqrt(np.prod([np.dot(f.probs, f.values ** 2) for f in factors]) - mean ** 2)
+        errors = {
+            'mean': float(abs(Z.expected_value() / mean - 1)) if mean else 0.0,
+            'stdev': float(abs(Z.calculate_stdev() / stdev - 1)) if stdev else 0.0,
+        }
+        if exact:
+            N = factors[0]
+            for f in factors[1:]:
+                N = N * f
+            x = np.union1d(N.values, Z.values)
+            # both CDFs are step functions, constant between consecutive points of x
+            gap = np.abs(N.cdf(x) - Z.cdf(x))
+            errors['wasserstein'] = float(np.dot(gap[:-1], np.diff(x)) / mean) if mean else 0.0
+        return Z, errors
+
+    # (mean, variance) of the result of each operator on independent operands
+    MOMENTS = {
+        'add': lambda x, y: (x[0] + y[0], x[1] + y[1]),
+        'sub': lambda x, y: (x[0] - y[0], x[1] + y[1]),
+        'mul': lambda x, y: (x[0] * y[0], x[1] * y[1] + x[1] * y[0] ** 2 + y[1] * x[0] ** 2),
+        'radd': lambda x, c: (c + x[0], x[1]),
+        'rsub': lambda x, c: (c - x[0], x[1]),
+        'rmul': lambda x, c: (c * x[0], c ** 2 * x[1]),
+    }
+
+    # largest dense lattice vector, as a multiple of the number of outcomes
+    LATTICE_FILL = 64
+
+    def lattice_step(self):
+        """ Grid step h when every outcome is values[0] + k * h for an integer k
+        (uniform and normal DRVs, sums of them, integer outcomes, ...), else 0 """
+        if self._step is None:
+            self._step = 0.0
+            x = self.values
+            if len(x) > 1:
+                h = np.diff(x).min()
+                k = (x - x[0]) / h
+                if h > 0 and k[-1] < DRV.LATTICE_FILL * len(x) and np.allclose(k, np.round(k), rtol=0, atol=1e-6):
+                    self._step = float(h)
+        return self._step
+
+    def _lattice_probs(self, step):
+        """ Probabilities on the dense grid values[0], values[0] + step, ... """
+        k = np.round((self.values - self.values[0]) / step).astype(int)
+        return np.bincount(k, self.probs, k[-1] + 1)
+
+    @staticmethod
+    def _convolve(a, b):
+        """ Full linear convolution, through the FFT for long vectors """
+        if min(len(a), len(b)) < 64:
+            return np.convolve(a, b)
+        n = len(a) + len(b) - 1
+        nfft = 1 << (n - 1).bit_length()
+        return np.fft.irfft(np.fft.rfft(a, nfft) * np.fft.rfft(b, nfft), nfft)[:n]
+
+    def _lattice_sum(self, other, sign):
+        """ self + other (sign 1) or self - other (sign -1) as a convolution of
+        probability vectors when both lie on lattices with the same step;
+        None when they do not, so the caller falls back to apply """
+        if not isinstance(other, DRV) or len(self.values) < 2 or len(other.values) < 2:
+            return None
+        step = self.lattice_step()
+        if not step or not np.isclose(step, other.lattice_step(), rtol=1e-9, atol=0):
+            return None
+
+        px, py = self._lattice_probs(step), other._lattice_probs(step)
+        origin = self.values[0] + other.values[0]
+        if sign < 0:
+            py, origin = py[::-1], self.values[0] - other.values[-1]
+        probs = DRV._convolve(px, py)
+        # FFT round-off leaves noise where the exact result is 0
+        probs[probs < 1e-15 * probs.max()] = 0
+        values = origin + step * np.arange(len(probs))
+
+        Z = DRV.from_arrays(values[probs > 0], probs[probs > 0])._compact(self, other)
+        Z._moments = DRV.MOMENTS['add' if sign > 0 else 'sub'](self.moments(), other.moments())
         return Z
 
     def __add__(self, other):
-        return self.apply(other, lambda x, y: x + y)
+        Z = self._lattice_sum(other, 1)
+        if Z is not None:
+            return Z
+        return self.apply(other, lambda x, y: x + y, DRV.MOMENTS['add'])
 
     def __radd__(self, a):
-        return self.applyscalar(a, lambda x, c: c + x)
+        return self.applyscalar(a, lambda x, c: c + x, DRV.MOMENTS['radd'])
 
     def __rmul__(self, a):
-        return self.applyscalar(a, lambda x, c: c * x)
+        return self.applyscalar(a, lambda x, c: c * x, DRV.MOMENTS['rmul'])
 
     def __rsub__(self, a):
-        return self.applyscalar(a, lambda x, c: c - x)
+        return self.applyscalar(a, lambda x, c: c - x, DRV.MOMENTS['rsub'])
 
     def __sub__(self, other):
-        return self.apply(other, lambda x, y: x - y)
+        Z = self._lattice_sum(other, -1)
+        if Z is not None:
+            return Z
+        return self.apply(other, lambda x, y: x - y, DRV.MOMENTS['sub'])
 
     def __mul__(self, other):
-        return self.apply(other, lambda x, y: x * y)
+        return self.apply(other, lambda x, y: x * y, DRV.MOMENTS['mul'])
 
     def __truediv__(self, other):
         # might require div by 0 handling
@@ -94,39 +401,100 @@ class DRV:
         return self.apply(other, lambda x, y: x ** y)
 
     def __repr__(self):
-        xp = sorted(self.dist.items())
         rslt = ''
-        for x, p in xp:
+        for x, p in zip(self.values.tolist(), self.probs.tolist()):
             rslt += str(round(x)) + " : " + str(round(p, 8)) + "\n"
         return rslt
 
+    def moments(self):
+        """ (mean, variance), carried over analytically from the operands when
+        this DRV came from +, - or * and computed from the outcomes otherwise """
+        if self._moments is None:
+            mean = float(np.dot(self.values, self.probs))
+            self._moments = (mean, float(np.dot(self.probs, (self.values - mean) ** 2)))
+        return self._moments
+
     def expected_value(self):
         """Compute the expected value of the discrete random variable."""
-        return sum(x * p for x, p in self.dist.items())
+        return self.moments()[0]
 
     def calculate_stdev(self):
         """Compute the standard deviation of the discrete random variable."""
-        mean = self.expected_value()
-        variance = sum(p * (x - mean) ** 2 for x, p in self.dist.items())
-        return np.sqrt(variance)
+        return np.sqrt(max(self.moments()[1], 0.0))
+
+    def cumulative(self):
+        """ Running total of the probabilities, built once per set of outcomes """
+        if self._cumulative is None:
+            self._cumulative = np.cumsum(self.probs)
+        return self._cumulative
+
+    def cdf(self, x):
+        """ P(X <= x), for a number or an array """
+        i = np.searchsorted(self.values, x, side='right')
+        return np.where(i > 0, self.cumulative()[np.maximum(i - 1, 0)], 0.0)[()]
+
+    def quantile(self, q):
+        """ Smallest outcome whose cdf reaches q, for a number or an array """
+        cumulative = self.cumulative()
+        i = np.searchsorted(cumulative, np.asarray(q) * cumulative[-1], side='left')
+        return self.values[np.minimum(i, len(self.values) - 1)][()]
+
+    def prob_between(self, a, b):
+        """ P(a <= X <= b) """
+        return self.cdf(b) - self.cdf(np.nextafter(a, -np.inf))
+
+    def alias_table(self):
+        """ Walker/Vose alias table (acceptance probabilities, alias indices)
+        for the outcomes, built once and cached until the outcomes change """
+        if self._alias is None:
+            n = len(self.probs)
+            scaled = self.probs * (n / self.probs.sum())
+            accept = np.ones(n)
+            alias = np.arange(n)
+            small = [i for i in range(n) if scaled[i] < 1]
+            large = [i for i in range(n) if scaled[i] >= 1]
+            while small and large:
+                s, l = small.pop(), large.pop()
+                accept[s] = scaled[s]
+                alias[s] = l
+                # the large outcome gives its excess to fill the small one's column
+                scaled[l] -= 1 - scaled[s]
+                (small if scaled[l] < 1 else large).append(l)
+            # whatever is left over is 1 up to rounding
+            self._alias = (accept, alias)
+        return self._alias
+
+    def sample(self, n, rng=None):
+        """ n random samples as an array, drawn in one vectorized call.
+        rng is a numpy Generator or a seed; None draws from fresh OS entropy """
+        rng = np.random.default_rng(rng)
+        if self.dist_type == 'uniform':
+            return rng.uniform(self.min_val, self.max_val, n)
+        elif self.dist_type == 'normal':
+            return rng.normal(self.mean, self.stdev, n)
+        accept, alias = self.alias_table()
+        i = rng.integers(len(accept), size=n)
+        return self.values[np.where(rng.random(n) < accept[i], i, alias[i])]
 
     def random(self):
         """Generate a random sample from the distribution"""
         if self.dist_type == 'discrete':
-            return random.choices(list(self.dist.keys()), weights=list(self.dist.values()))[0]
+            accept, alias = self.alias_table()
+            i = random.randrange(len(accept))
+            return float(self.values[i if random.random() < accept[i] else alias[i]])
         elif self.dist_type == 'uniform':
             return random.uniform(self.min_val, self.max_val)
         elif self.dist_type == 'normal':
             return random.normalvariate(self.mean, self.stdev)
 
     def plot(self, title='', xscale='', yscale='',
-             trials=0, bins=20, show_cumulative=False):
+             trials=0, bins=20, show_cumulative=False, rng=None):
         """Display the DRV distribution"""
 
         if trials == 0:
-            plt.bar(self.dist.keys(), self.dist.values())
+            plt.bar(self.values, self.probs)
         else:
-            sample = [self.random() for i in range(trials)]
+            sample = self.sample(trials, rng)
             sns.displot(sample, kind='hist', stat='probability', bins=bins)
 
 
@@ -143,14 +511,6 @@ class DRV:
 
         if show_cumulative:
             plt.yticks([0.0, 0.25, 0.50, 0.75, 1.00])
-            xp = sorted(list(self.dist.items()))
-            xval = [t[0] for t in xp]
-            pval = [t[1] for t in xp]
-            totalp = 0.0
-            pcumul = []
-            for p in pval:
-                totalp += p
-                pcumul.append(totalp)
-            sns.lineplot(x=xval, y=pcumul)
+            sns.lineplot(x=self.values, y=self.cumulative())
 
         plt.show()
\ No newline at end of file
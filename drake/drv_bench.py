@@ -0,0 +1,209 @@
+'''
+File: drv_bench.py
+Times DRV operations as the support and the length of a Drake-style product
+grow, records time and peak traced memory, and compares runs
+
+Usage:
+    python drv_bench.py                                  # 10 .. 100k outcomes
+    python drv_bench.py --sizes 10 100 1000 --out result.json
+    python drv_bench.py --out new.json --baseline result.json --threshold 0.2   # on a quiet machine
+'''
+
+import argparse
+import gc
+import json
+import sys
+import time
+import timeit
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from drv import DRV
+
+SIZES = (10, 100, 1000, 10000, 100000)
+CHAIN_LENGTHS = (1, 2, 3, 4, 5, 6, 7, 8)
+# outcomes of the fixed right operand in binary operations
+OTHER_SIZE = 10
+# draws per random() case and samples per plot(trials=...) case
+RANDOM_CALLS = 1000
+PLOT_TRIALS = 100000
+
+def random_drv(n, rng):
+    """ n positive outcomes off any grid, so operators take the exact path """
+    return DRV.from_arrays(rng.uniform(0.5, 2.0, n), rng.dirichlet(np.ones(n)))
+
+
+def plot(X):
+    X.plot(trials=PLOT_TRIALS, rng=0)
+    plt.close('all')
+
+
+def random_calls(X):
+    for _ in range(RANDOM_CALLS):
+        X.random()
+
+
+# case -> (function of X with n outcomes, Y with OTHER_SIZE outcomes and a
+# uniform lattice DRV with n outcomes; whether X must be new on every call so
+# nothing it caches, like moments or the alias table, is reused)
+CASES = {
+    'apply': (lambda X, Y, lattice: X.apply(Y, lambda x, y: x * y), False),
+    'add': (lambda X, Y, lattice: X + Y, False),
+    'sub': (lambda X, Y, lattice: X - Y, False),
+    'mul': (lambda X, Y, lattice: X * Y, False),
+    'truediv': (lambda X, Y, lattice: X / Y, False),
+    'pow': (lambda X, Y, lattice: X ** Y, False),
+    'radd': (lambda X, Y, lattice: 2.0 + X, False),
+    'rsub': (lambda X, Y, lattice: 2.0 - X, False),
+    'rmul': (lambda X, Y, lattice: 2.0 * X, False),
+    'add_lattice': (lambda X, Y, lattice: lattice + lattice, False),
+    'expected_value': (lambda X, Y, lattice: X.expected_value(), True),
+    'calculate_stdev': (lambda X, Y, lattice: X.calculate_stdev(), True),
+    'random': (lambda X, Y, lattice: random_calls(X), True),
+    'plot_trials': (lambda X, Y, lattice: plot(X), False),
+}
+
+# a run counts as a regression only if it is slower by this fraction of the
+# baseline; on a shared machine best-of-5 timings of unchanged code drift by
+# up to ~30% between runs
+THRESHOLD = 0.5
+
+# and slower by at least this much; differences below it are timer noise
+MIN_DELTA_SECONDS = 1e-3
+
+# memory the pre-built fresh operands of one timed batch may take
+FRESH_BATCH_BYTES = 2 ** 26
+
+
+def measure(case, X, Y, lattice, repeat):
+    """ best time per call over repeat runs, each run long enough to time reliably
+    (timeit's autorange, at least 0.2 s), and the peak traced allocation of one call """
+    func, fresh = CASES[case]
+
+    def copy():
+        # a new DRV with X's outcomes and nothing cached yet
+        return DRV.from_arrays(X.values, X.probs) if fresh else X
+
+    number, _ = timeit.Timer(lambda: func(copy(), Y, lattice)).autorange()
+    batch = max(1, min(number, FRESH_BATCH_BYTES // (X.values.nbytes + X.probs.nbytes))) if fresh else number
+
+    best = float('inf')
+    for _ in range(repeat):
+        elapsed = 0.0
+        for done in range(0, number, batch):
+            # fresh operands are built outside the timed loop
+            operands = [copy() for _ in range(min(batch, number - done))]
+            gc.collect()
+            start = time.perf_counter()
+            for operand in operands:
+                func(operand, Y, lattice)
+            elapsed += time.perf_counter() - start
+        best = min(best, elapsed / number)
+
+    operand = copy()
+    gc.collect()
+    tracemalloc.start()
+    func(operand, Y, lattice)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+
+def support_scaling(sizes, cases, repeat, seed=0):
+    """ {case: {size: measurement}} with X of each size against a fixed Y """
+    rng = np.random.default_rng(seed)
+    Y = random_drv(OTHER_SIZE, rng)
+    results = {case: {} for case in cases}
+    for n in sizes:
+        X = random_drv(n, rng)
+        lattice = DRV(dist_type='uniform', min_val=0, max_val=1, bins=n)
+        for case in cases:
+            results[case][str(n)] = measure(case, X, Y, lattice, repeat)
+    return results
+
+
+def chain_scaling(lengths, repeat, size=5, seed=0):
+    """ {length: measurement} for products of length factors of size outcomes """
+    rng = np.random.default_rng(seed)
+    factors = [random_drv(size, rng) for _ in range(max(lengths))]
+    results = {}
+    for k in lengths:
+        def product():
+            N = factors[0]
+            for f in factors[1:k]:
+                N = N * f
+            return N
+
+        timer = timeit.Timer(product)
+        number, _ = timer.autorange()
+        seconds = min(timer.repeat(repeat, number)) / number
+        gc.collect()
+        tracemalloc.start()
+        product()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[str(k)] = {'seconds': seconds, 'peak_bytes': peak}
+    return results
+
+
+def regressions(result, baseline, threshold=THRESHOLD, min_delta=MIN_DELTA_SECONDS):
+    """ measurements whose time or peak memory grew by more than threshold
+    (a fraction) over the same measurement in the baseline; times must also
+    have grown by min_delta seconds """
+    found = []
+    pairs = [(f'{case} n={n}', now, baseline.get('support', {}).get(case, {}).get(n))
+             for case, rows in result['support'].items() for n, now in rows.items()]
+    pairs += [(f'chain k={k}', now, baseline.get('chain', {}).get(k)) for k, now in result['chain'].items()]
+    for name, now, before in pairs:
+        if before is None:
+            continue
+        for key, floor in [('seconds', min_delta), ('peak_bytes', 0)]:
+            if before[key] > 0 and now[key] > before[key] * (1 + threshold) and now[key] - before[key] >= floor:
+                found.append(f'{name} {key}: {before[key]:.4g} -> {now[key]:.4g}')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DRV operations as supports and chains grow')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--chain', type=int, nargs='+', default=list(CHAIN_LENGTHS))
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per measurement; the best is kept')
+    parser.add_argument('--out', help='write the json result here')
+    parser.add_argument('--baseline', help='json result of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='allowed slowdown over the baseline')
+    parser.add_argument('--min-delta', type=float, default=MIN_DELTA_SECONDS,
+                        help='smallest slowdown in seconds that counts as a regression')
+    args = parser.parse_args()
+
+    result = {
+        'support': support_scaling(args.sizes, args.cases, args.repeat),
+        'chain': chain_scaling(args.chain, args.repeat),
+    }
+
+    print(f"{'case':16}" + ''.join(f'{n:>18}' for n in args.sizes))
+    for case, rows in result['support'].items():
+        print(f'{case:16}' + ''.join(f"{rows[str(n)]['seconds'] * 1000:10.3f} ms {rows[str(n)]['peak_bytes'] / 2 ** 20:4.0f}M"
+                                     for n in args.sizes))
+    for k, row in result['chain'].items():
+        print(f"chain k={k:<8}{row['seconds'] * 1000:10.3f} ms {row['peak_bytes'] / 2 ** 20:4.0f}M")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.threshold, args.min_delta)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
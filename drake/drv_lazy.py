@@ -0,0 +1,168 @@
+'''
+File: drv_lazy.py
+Lazy DRV arithmetic: operators build an expression graph that is evaluated
+in a cheap order, reusing common subexpressions, only when a value is needed
+'''
+
+import heapq
+import itertools
+import math
+import operator
+from collections import Counter
+
+from drv import DRV
+
+# operators whose operands may be regrouped and reordered freely
+CHAIN_OPS = {'add': operator.add, 'mul': operator.mul}
+BINARY_OPS = {'sub': operator.sub, 'truediv': operator.truediv, 'pow': operator.pow}
+SCALAR_OPS = {'radd': DRV.__radd__, 'rmul': DRV.__rmul__, 'rsub': DRV.__rsub__}
+
+class LazyDRV:
+    """ A DRV expression, computed on plot, evaluate or any other DRV
+    attribute. Wrap the inputs of a model to opt in: LazyDRV(DRV(...)).
+    expected_value and calculate_stdev come from moments propagated through
+    the graph and only compute it when it has / or ** in it """
+
+    def __init__(self, drv=None, op='leaf', args=()):
+        """ Constructor; a leaf wraps drv, other nodes apply op to args """
+        self.drv = drv
+        self.op = op
+        self.args = args
+        self._key = None
+        self._value = None
+        self._moments = None
+
+    @staticmethod
+    def wrap(x):
+        return x if isinstance(x, LazyDRV) else LazyDRV(x)
+
+    def __add__(self, other):
+        return LazyDRV(op='add', args=(self, LazyDRV.wrap(other)))
+
+    def __radd__(self, a):
+        if isinstance(a, DRV):
+            return LazyDRV(a) + self
+        return LazyDRV(op='radd', args=(a, self))
+
+    def __mul__(self, other):
+        return LazyDRV(op='mul', args=(self, LazyDRV.wrap(other)))
+
+    def __rmul__(self, a):
+        if isinstance(a, DRV):
+            return LazyDRV(a) * self
+        return LazyDRV(op='rmul', args=(a, self))
+
+    def __sub__(self, other):
+        return LazyDRV(op='sub', args=(self, LazyDRV.wrap(other)))
+
+    def __rsub__(self, a):
+        if isinstance(a, DRV):
+            return LazyDRV(a) - self
+        return LazyDRV(op='rsub', args=(a, self))
+
+    def __truediv__(self, other):
+        return LazyDRV(op='truediv', args=(self, LazyDRV.wrap(other)))
+
+    def __rtruediv__(self, other):
+        return LazyDRV(other) / self
+
+    def __pow__(self, other):
+        return LazyDRV(op='pow', args=(self, LazyDRV.wrap(other)))
+
+    def __rpow__(self, other):
+        return LazyDRV(other) ** self
+
+    def operands(self):
+        """ Operands of a chain, looking through nested nodes of the same operator """
+        found = []
+        for arg in self.args:
+            found.extend(arg.operands() if arg.op == self.op else [arg])
+        return found
+
+    def key(self):
+        """ Canonical form of the expression, equal for equal subexpressions:
+        leaves are their DRV and chains the multiset of their operands' keys """
+        if self._key is None:
+            if self.op == 'leaf':
+                self._key = self.drv
+            elif self.op in CHAIN_OPS:
+                self._key = (self.op, frozenset(Counter(arg.key() for arg in self.operands()).items()))
+            elif self.op in SCALAR_OPS:
+                self._key = (self.op, self.args[0], self.args[1].key())
+            else:
+                self._key = (self.op, self.args[0].key(), self.args[1].key())
+        return self._key
+
+    def evaluate(self, cache=None):
+        """ The expression's DRV. Pass the same cache dict to several
+        evaluations to share subexpressions between them """
+        if self._value is None:
+            self._value = self._evaluate({} if cache is None else cache)
+        return self._value
+
+    def _evaluate(self, cache):
+        key = self.key()
+        if key not in cache:
+            if self.op == 'leaf':
+                cache[key] = self.drv
+            elif self.op in CHAIN_OPS:
+                cache[key] = LazyDRV._reduce_chain(self.op, self.operands(), cache)
+            elif self.op in SCALAR_OPS:
+                cache[key] = SCALAR_OPS[self.op](self.args[1]._evaluate(cache), self.args[0])
+            else:
+                cache[key] = BINARY_OPS[self.op](self.args[0]._evaluate(cache), self.args[1]._evaluate(cache))
+        return cache[key]
+
+    @staticmethod
+    def _reduce_chain(op, operands, cache):
+        """ Combines the two smallest supports first until one DRV is left;
+        partial results are cached under the multiset of operands they cover """
+        tiebreak = itertools.count()
+        heap = []
+        for arg in operands:
+            value = arg._evaluate(cache)
+            heapq.heappush(heap, (len(value.values), next(tiebreak), Counter([arg.key()]), value))
+
+        while len(heap) > 1:
+            _, _, keys_x, x = heapq.heappop(heap)
+            _, _, keys_y, y = heapq.heappop(heap)
+            keys = keys_x + keys_y
+            key = (op, frozenset(keys.items()))
+            if key not in cache:
+                cache[key] = CHAIN_OPS[op](x, y)
+            heapq.heappush(heap, (len(cache[key].values), next(tiebreak), keys, cache[key]))
+        return heap[0][3]
+
+    def moments(self):
+        """ (mean, variance) of the expression, using DRV.MOMENTS where the
+        operator has a rule and the computed DRV otherwise """
+        if self._moments is None:
+            if self._value is not None:
+                self._moments = self._value.moments()
+            elif self.op == 'leaf':
+                self._moments = self.drv.moments()
+            elif self.op in SCALAR_OPS:
+                self._moments = DRV.MOMENTS[self.op](self.args[1].moments(), self.args[0])
+            elif self.op in DRV.MOMENTS:
+                self._moments = DRV.MOMENTS[self.op](self.args[0].moments(), self.args[1].moments())
+            else:
+                self._moments = self.evaluate().moments()
+        return self._moments
+
+    def expected_value(self):
+        return self.moments()[0]
+
+    def calculate_stdev(self):
+        return math.sqrt(max(self.moments()[1], 0.0))
+
+    def plot(self, *args, **kwargs):
+        return self.evaluate().plot(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # anything else a DRV offers materializes the expression
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.evaluate(), name)
+
+    def __repr__(self):
+        return repr(self.evaluate())
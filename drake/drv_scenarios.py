@@ -0,0 +1,80 @@
+'''
+File: drv_scenarios.py
+Monte Carlo runner for Drake-equation scenarios: every scenario is a set of
+independent factor DRVs whose product is simulated in its own process
+
+Usage:
+    python drv_scenarios.py --trials 1000000 --workers 8
+'''
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from drv import DRV
+from drake_equation_hw4 import drake_factors
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+def simulate(factors, trials, quantiles, seed):
+    """ Summary of trials samples of the product of the factors, drawing
+    from a generator seeded with seed (a numpy SeedSequence) """
+    rng = np.random.default_rng(seed)
+    N = np.ones(trials)
+    for factor in factors:
+        N *= factor.sample(trials, rng)
+    return {
+        'trials': trials,
+        'mean': float(N.mean()),
+        'stdev': float(N.std()),
+        'quantiles': dict(zip(quantiles, np.quantile(N, quantiles).tolist())),
+    }
+
+
+def run_scenarios(scenarios, trials=100000, quantiles=QUANTILES, seed=0, workers=None):
+    """ Simulates every scenario, a {name: list of factor DRVs} dict, over a
+    process pool and returns {name: summary}. Each scenario gets its own
+    stream spawned from seed, so results do not depend on the number of
+    workers or the order the pool runs them in """
+    names = list(scenarios)
+    seeds = np.random.SeedSequence(seed).spawn(len(names))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(simulate, list(scenarios[name]), trials, tuple(quantiles), s)
+                   for name, s in zip(names, seeds)]
+        return {name: future.result() for name, future in zip(names, futures)}
+
+
+def lifetime_sweep(lifetimes=(100, 1000, 10000, 100000, 1000000), spreads=(0.5, 1, 2)):
+    """ Scenarios replacing L in the homework model with a uniform lifetime
+    around each centre, for every relative spread """
+    factors = drake_factors()
+    scenarios = {}
+    for centre in lifetimes:
+        for spread in spreads:
+            factors['L'] = DRV(dist_type='uniform', min_val=centre / (1 + spread),
+                               max_val=centre * (1 + spread), bins=100)
+            scenarios[f'L~{centre:g} x{1 + spread:g}'] = list(factors.values())
+    return scenarios
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo sweep of Drake-equation scenarios')
+    parser.add_argument('--trials', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    scenarios = {'hw4': list(drake_factors().values())}
+    scenarios.update(lifetime_sweep())
+    results = run_scenarios(scenarios, args.trials, seed=args.seed, workers=args.workers)
+
+    print(f"{'scenario':20} {'mean':>12} {'stdev':>12} " + ' '.join(f'{f"q{q:g}":>12}' for q in QUANTILES))
+    for name, summary in results.items():
+        quantiles = ' '.join(f'{v:12.1f}' for v in summary['quantiles'].values())
+        print(f"{name:20} {summary['mean']:12.1f} {summary['stdev']:12.1f} {quantiles}")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,10 @@ accessed through api in sunspot_api.py
 from dash import Dash, html, dcc, Input, Output
 import plotly.express as px
 from datetime import datetime as dt
-from sunspot_api import SunspotAPI
+from sunspot_api import SunspotAPI, HIST_BIN_WIDTH
+from sunspot_cache import FigureCache
+from sunspot_images import ImageProxy
+from sunspot_stats import STATS
 import pandas as pd
 import dash_bootstrap_components as dbc
 from dash_bootstrap_templates import load_figure_template
@@ -17,10 +20,28 @@ from dash_bootstrap_templates import load_figure_template
 # load styling template
 load_figure_template('CYBORG')
 
-def main():
-    # initialize the app object
+# memory limit for cached figure JSON
+FIGURE_CACHE_BYTES = 64 * 2**20
+
+def create_app(dbfile="sunspot.db", cache_bytes=FIGURE_CACHE_BYTES, live_images=True):
+    """
+    Function: create_app - builds the dashboard without serving it, so it can run
+        under a multi-threaded or multi-process WSGI server (see create_server)
+
+    Parameters:
+        dbfile: path of the sunspot database built by to_database.py
+        cache_bytes: memory limit of the figure cache (0 disables it)
+        live_images: whether to start refreshing the live images in the background
+
+    Returns: the Dash app
+    """
+    # initialize the app object; each worker thread reads through its own
+    # read-only connection
     api = SunspotAPI()
-    api.connect("sunspot.db")
+    api.connect(dbfile, in_memory=True)
+
+    # figures are pure functions of the inputs and the data version
+    cache = FigureCache(max_bytes=cache_bytes, latency=STATS)
 
     # create the dash app
     app = Dash(__name__, external_stylesheets=[dbc.themes.CYBORG])
@@ -42,8 +63,18 @@ def main():
     decades = list(range(1810, 2001, 10))  
     decades = [{'label': f'{decade}s', 'value': decade} for decade in range(1820, 2020, 10)]
 
+    # serve the images from a local cache refreshed in the background,
+    # instead of every viewer fetching them from upstream
+    images = ImageProxy(image_urls)
+    images.register(app.server)
+    if live_images:
+        images.start()
+
+    # per-callback and per-stage latency percentiles at /stats
+    STATS.register(app.server)
+
     # create dictionary with label - value pairs
-    dropdown_options = [{'label': key, 'value': value} for key, value in image_urls.items()]
+    dropdown_options = [{'label': key, 'value': key} for key in image_urls]
 
     # create the layout
     app.layout = html.Div([
@@ -108,7 +139,7 @@ def main():
             dcc.Dropdown(
                 id='image-dropdown',
                 options=dropdown_options,
-                value=list(image_urls.values())[0]),
+                value=list(image_urls)[0]),
             # add image
             html.Img(
                 id='sun-image',
@@ -148,6 +179,8 @@ def main():
         Input('year_range', 'value'),
         Input('smoothing_period', 'value')
     )
+    @STATS.timed('update_line_graph')
+    @cache.memoize(api.refresh)
 
     # sunspot activity over time graph
     def update_line_graph(year_range, smoothing_period):
@@ -163,38 +196,47 @@ def main():
         # extract tuple from callback input
         start_year, end_year = year_range
 
-        # get start and end date from api
-        df = api.get_sunspot_amt_range(start_year, end_year)
+        # get the coarsest resolution that still fills the chart from api
+        with STATS.timer('update_line_graph.query'):
+            level, df = api.get_sunspot_series(start_year, end_year)
+
+        # smooth the daily data over the window from callback input, in calendar
+        # months, from the api's precomputed prefix sums
+        with STATS.timer('update_line_graph.smoothing'):
+            smoothed = api.get_smoothed_range(start_year, end_year, smoothing_period)
 
-        # smooth dataframe based on window from callback input
-        df['Smoothed'] = df['Daily_Sunspot_Total'].rolling(window=smoothing_period).mean()
+        # downsample both traces to the chart's point budget
+        with STATS.timer('update_line_graph.downsample'):
+            raw = api.downsample(df, 'Daily_Sunspot_Total')
+            smoothed = api.downsample(smoothed, 'Smoothed')
 
         # plot figure
-        fig = px.line(
-            df,
-            x='Date_Fraction',
-            y='Daily_Sunspot_Total',
-            template="plotly_dark"
-        )
-
-        # add title
-        fig.update_layout(title_text='Sunspot Activity over Time', title_x=0.5)
-
-        # add labels to x and y axis
-        fig.update_xaxes(title_text="Year")
-        fig.update_yaxes(title_text="Sunspot Activity")
-
-        fig.add_scatter(
-            x=df['Date_Fraction'],
-            y=df['Smoothed'],
-            mode='lines',
-            name='Smoothed'
-        )
-        fig.update_traces(
-            overwrite=True,
-            selector=dict(name='Smoothed'),
-            line=dict(color='red', width=4)
-        )
+        with STATS.timer('update_line_graph.figure'):
+            fig = px.line(
+                raw,
+                x='Date_Fraction',
+                y='Daily_Sunspot_Total',
+                template="plotly_dark"
+            )
+
+            # add title
+            fig.update_layout(title_text='Sunspot Activity over Time', title_x=0.5)
+
+            # add labels to x and y axis
+            fig.update_xaxes(title_text="Year")
+            fig.update_yaxes(title_text="Sunspot Activity")
+
+            fig.add_scatter(
+                x=smoothed['Date_Fraction'],
+                y=smoothed['Smoothed'],
+                mode='lines',
+                name='Smoothed'
+            )
+            fig.update_traces(
+                overwrite=True,
+                selector=dict(name='Smoothed'),
+                line=dict(color='red', width=4)
+            )
 
         return fig
 
@@ -205,6 +247,8 @@ def main():
         Input('year_range', 'value'),
         Input('cycle_period', 'value')
     )
+    @STATS.timed('update_cycle_graph')
+    @cache.memoize(api.refresh)
 
     # second graph - sunspot cycle variability
     def update_cycle_graph(year_range, cycle_period):
@@ -220,27 +264,38 @@ def main():
         # extract tuple from callback input
         start_year, end_year = year_range
 
-        # gets data for data range
-        df = SunspotAPI.get_sunspot_amt_range(start_year, end_year)
-
-        # take only the cycler period from callback input
-        df['Cycle_Year'] = df['Date_Fraction'] % cycle_period
+        # get the range folded at the chosen period; all slider steps are
+        # precomputed together, so moving the cycle slider is a lookup
+        with STATS.timer('update_cycle_graph.query'):
+            phase, counts, density = api.get_cycle_density(start_year, end_year, cycle_period)
+            folds = api.get_cycle_folds(start_year, end_year)
+            best_period = folds['periods'][folds['strength'].argmax()]
 
         # plot figure
-        fig = px.scatter(
-            df,
-            x='Cycle_Year',
-            y='Daily_Sunspot_Total',
-            title='Sunspot Cycle Variability',
-            labels={
-                'Cycle_Year': 'Years',
-                'Daily_Sunspot_Total': '# of Sunspots'
-            },
-            template="plotly_dark"
-        )
-
-        # add title
-        fig.update_layout(title_text='Sunspot Cycle Variability', title_x=0.5)
+        with STATS.timer('update_cycle_graph.figure'):
+            fig = px.imshow(
+                density,
+                x=phase,
+                y=counts,
+                origin='lower',
+                aspect='auto',
+                labels={
+                    'x': 'Years',
+                    'y': '# of Sunspots',
+                    'color': 'Days'
+                },
+                template="plotly_dark"
+            )
+
+            # mark the period that folds the range most tightly
+            fig.add_annotation(
+                text=f'Best fold: {best_period:.1f} years',
+                xref='paper', yref='paper', x=1, y=1.08,
+                showarrow=False
+            )
+
+            # add title
+            fig.update_layout(title_text='Sunspot Cycle Variability', title_x=0.5)
 
         return fig
 
@@ -249,18 +304,22 @@ def main():
         Output('sun-image', 'src'),
         Input('image-dropdown', 'value')
     )
+    @STATS.timed('update_image_src')
 
     # runs url
-    def update_image_src(selected_url):
+    def update_image_src(selected_image):
         """
-        Function: update_image_src - updates source url for a live-updated image from url
+        Function: update_image_src - updates source url for a live-updated image
         
         Parameters:
-            selected_url: string representing url to obtain image from
+            selected_image: name of the image to show, a key of image_urls
             
-        Returns: the source url
+        Returns: the local proxy url of the image, or None (no image) when the
+            dropdown is cleared or holds an unknown name
         """
-        return selected_url
+        if not isinstance(selected_image, str) or selected_image not in image_urls:
+            return None
+        return images.url_for(selected_image)
 
 
     # fourth callback
@@ -268,6 +327,8 @@ def main():
         Output('sunspot-histogram', 'figure'),
         Input('decade-dropdown', 'value')
     )
+    @STATS.timed('update_histogram')
+    @cache.memoize(api.refresh)
 
     # third graph, daily sunpot total count histogram
     def update_histogram(selected_decade):
@@ -281,34 +342,54 @@ def main():
             
         Returns: graphed figure
         """
-        # establish start and end years
+        # establish start year
         start_year = selected_decade
-        end_year = start_year + 9
-
-        # get selected data
-        df = SunspotAPI.get_sunspot_amt_range(start_year, end_year)
-
-        # generate histogram
-        fig = px.histogram(
-            df, 
-            x='Daily_Sunspot_Total', 
-            title=f'Sunspot Distribution: {start_year}s', 
-            template = 'plotly_dark'
-        )
-
-        # add title
-        fig.update_layout(
-            title_text='Count of Daily Sunspot Totals over Chosen Decade', 
-            title_x=0.5
-        )
-
-        # add labels to x and y axis
-        fig.update_xaxes(title_text="Daily Sunspot Total")
-        fig.update_yaxes(title_text="Count over Decade")
+
+        # get precomputed bin edges and counts for the decade
+        with STATS.timer('update_histogram.query'):
+            hist = api.get_decade_histogram(start_year)
+
+        # draw the counts as touching bars, one per bin
+        with STATS.timer('update_histogram.figure'):
+            fig = px.bar(
+                x=(hist['Bin_Start'] + hist['Bin_End']) / 2,
+                y=hist['Count'],
+                title=f'Sunspot Distribution: {start_year}s', 
+                template = 'plotly_dark'
+            )
+            fig.update_traces(width=HIST_BIN_WIDTH)
+            fig.update_layout(bargap=0)
+
+            # add title
+            fig.update_layout(
+                title_text='Count of Daily Sunspot Totals over Chosen Decade', 
+                title_x=0.5
+            )
+
+            # add labels to x and y axis
+            fig.update_xaxes(title_text="Daily Sunspot Total")
+            fig.update_yaxes(title_text="Count over Decade")
         
+
         return fig
 
-    # run server
+    return app
+
+def create_server(dbfile="sunspot.db"):
+    """
+    Function: create_server - WSGI entry point, e.g.
+        gunicorn -w 4 --threads 4 "sunspot:create_server()"
+
+    Parameters:
+        dbfile: path of the sunspot database built by to_database.py
+
+    Returns: the Flask server behind the Dash app
+    """
+    return create_app(dbfile).server
+
+def main():
+    # create and run server
+    app = create_app()
     app.run_server(debug=True)
 
 if __name__ == '__main__':
@@ -3,36 +3,658 @@ File: sunspot_api.py
 Description: API for accessing data from the sunspot.db
 """
 
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from urllib.request import pathname2url
+import numpy as np
 import pandas as pd
 import sqlite3
+from sunspot_stats import STATS
+
+# every column of the sunspot table, in table order
+COLUMNS = ('Year', 'Month', 'Day', 'Date_Fraction', 'Daily_Sunspot_Total',
+           'Daily_Standard_Deviation', 'Observations', 'Def_prov')
+
+# the columns the dashboard charts actually read
+CHART_COLUMNS = ('Date_Fraction', 'Daily_Sunspot_Total')
+
+# aggregate tables built by to_database.py, coarsest first, with their rows
+# per year; 'sunspot' is the raw daily table
+LEVELS = {
+    'sunspot_decade': 0.1,
+    'sunspot_yearly': 1,
+    'sunspot_monthly': 12,
+    'sunspot': 365.25,
+}
+
+# columns every aggregate table shares; Mean is handed out as Daily_Sunspot_Total
+# so the charts can draw any level the same way
+LEVEL_COLUMNS = ('Date_Fraction', 'Mean', 'Min', 'Max', 'Count', 'Std')
+
+# width of the fixed histogram bins built per decade by to_database.py
+HIST_BIN_WIDTH = 10
+
+# every position of the cycle period slider: 9.0-15.0 years in steps of 0.1
+CYCLE_PERIODS = np.round(np.arange(90, 151) / 10, 1)
+
+# phase columns of a folded density
+PHASE_BINS = 60
+
+# folded densities kept per (range, data version)
+FOLD_CACHE_SIZE = 8
+
+# daily ranges shared between callbacks, kept per (range, data version)
+RANGE_CACHE_SIZE = 16
+
+# columns the calendar-aware smoothing needs
+SMOOTHING_COLUMNS = ('Year', 'Month', 'Day', 'Date_Fraction', 'Daily_Sunspot_Total')
+
+# daily arrays of the in-memory store, as saved in the .npy snapshot
+SNAPSHOT_ARRAYS = ('dates', 'totals', 'days', 'cumsum')
+
+# seconds between checks of the database for a rebuild or a new data version;
+# every callback asks, so the check must not run per request
+REFRESH_INTERVAL = 1.0
+
+# point budget for a line trace: the charts are about half a screen wide, so
+# roughly one point per horizontal pixel
+CHART_POINTS = 1000
+
+
+def calendar_days(years, months, days):
+    """ datetime64[D] dates from year, month and day columns """
+    month_start = (np.asarray(years) - 1970) * 12 + np.asarray(months) - 1
+    return month_start.astype('datetime64[M]').astype('datetime64[D]') + (np.asarray(days) - 1)
+
+
+def rolling_mean_months(days, cumsum, months):
+    """ trailing mean over calendar months: each day averages the days after the same
+    day `months` months earlier, up to and including itself, read off the prefix sums
+    cumsum (cumsum[i] is the total of the first i days); NaN until a full window exists """
+    month = days.astype('datetime64[M]')
+    day_of_month = days - month.astype('datetime64[D]')
+
+    # same day of the month, months earlier, clipped to the end of shorter months
+    start_month = month - months
+    month_len = (start_month + 1).astype('datetime64[D]') - start_month.astype('datetime64[D]')
+    start = start_month.astype('datetime64[D]') + np.minimum(day_of_month, month_len - np.timedelta64(1, 'D'))
+
+    lo = np.searchsorted(days, start, side='right')
+    hi = np.arange(1, len(days) + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (cumsum[hi] - cumsum[lo]) / (hi - lo)
+    mean[start < days[0]] = np.nan
+    return mean
+
+
+def lttb_indices(x, y, max_points):
+    """ Largest-Triangle-Three-Buckets: indices of at most max_points points
+    that keep the visual shape (and peaks) of the y over x line """
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # the first and last points are always kept; the rest is split into
+    # max_points - 2 buckets that each contribute one point
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.intp)
+    idx = np.empty(max_points, dtype=np.intp)
+    idx[0] = 0
+    idx[-1] = n - 1
+
+    a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        cx = x[hi:next_hi].mean()
+        cy = y[hi:next_hi].mean()
+
+        # pick the point forming the largest triangle with the previously
+        # kept point and the average of the next bucket
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + np.argmax(area)
+        idx[i + 1] = a
+
+    return idx
+
+class ConnectionHolder:
+    """ owns one thread's connection and closes it once the thread's locals are
+    dropped, i.e. when the thread exits """
+
+    def __init__(self, con):
+        """ Constructor """
+        self.con = con
+        self.closer = weakref.finalize(self, con.close)
+
+
+class ConnectionPool:
+    """ hands every thread of the current process its own read-only connection,
+    so dashboard sessions read in parallel while the ingest job writes (WAL);
+    a connection lives as long as its thread """
+
+    def __init__(self, dbfile, mmap_size=256 * 2**20, cache_kib=16 * 2**10):
+        """ Constructor """
+        self.dbfile = dbfile
+        self.mmap_size = mmap_size
+        self.cache_kib = cache_kib
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ forgets every connection, e.g. when a forked worker inherits the pool """
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.holders = weakref.WeakSet()
+
+    def open(self):
+        """ opens a tuned read-only connection """
+        uri = f"file:{pathname2url(os.path.abspath(self.dbfile))}?mode=ro"
+        # only its own thread uses it, but it may be closed from another (see close)
+        con = sqlite3.connect(uri, uri=True, cached_statements=256, check_same_thread=False)
+        con.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        con.execute(f"PRAGMA cache_size = -{self.cache_kib}")
+        return con
+
+    def connection(self):
+        """ this thread's connection, opened on first use """
+        if self.pid != os.getpid():
+            self.reset()
+        holder = getattr(self.local, 'holder', None)
+        if holder is None:
+            holder = ConnectionHolder(self.open())
+            self.local.holder = holder
+            with self.lock:
+                self.holders.add(holder)
+        return holder.con
+
+    def close(self):
+        """ closes every open connection of this process """
+        with self.lock:
+            for holder in list(self.holders):
+                holder.closer()
+            self.reset()
+
+
+class Store:
+    """ one load of the in-memory columnar store; load() builds a new one, which connect/refresh
+    publish with a single assignment, so a reader holding a store never sees arrays of two versions """
+
+    def __init__(self, version=None, dates=None, totals=None, days=None, cumsum=None, levels=None, hists=None):
+        self.version = version
+        self.dates = dates
+        self.totals = totals
+        self.days = days
+        self.cumsum = cumsum
+        self.levels = levels or {}
+        self.hists = hists or {}
+        # smoothed series per window, built on demand from this store's days and cumsum
+        self.smoothed = {}
+
 
 class SunspotAPI:
-    con = None
+    pool = None
+    dbfile = None
+    in_memory = False
+
+    # identity of the database file and its data version (PRAGMA user_version,
+    # bumped by to_database.py) as of the last connect/refresh
+    db_stamp = None
+    version = None
+    refresh_lock = threading.Lock()
+    checked = 0.0
+
+    # query text per projection, so sqlite3's per-connection statement cache
+    # sees identical SQL and reuses the prepared statement
+    queries = {}
+
+    # in-memory columnar store, replaced as a whole by load()
+    store = Store()
+    folds = OrderedDict()
+
+    # shared range store: finished frames plus an event per range being loaded
+    ranges = OrderedDict()
+    pending = {}
+    range_lock = threading.Lock()
+
+    @staticmethod
+    def connect(dbfile, in_memory=False):
+        """ make a connection, optionally loading the daily series into memory """
+        SunspotAPI.pool = ConnectionPool(dbfile)
+        SunspotAPI.dbfile = dbfile
+        SunspotAPI.in_memory = in_memory
+        SunspotAPI.db_stamp = SunspotAPI.file_stamp()
+        SunspotAPI.checked = time.monotonic()
+        version = SunspotAPI.data_version()
+        SunspotAPI.store = SunspotAPI.load(version) if in_memory else Store(version)
+        # the version goes out last: whoever sees it also sees its store
+        SunspotAPI.version = version
+
+
+    @staticmethod
+    def file_stamp():
+        """ identifies the database file, which a full rebuild replaces """
+        st = os.stat(SunspotAPI.dbfile)
+        return st.st_dev, st.st_ino
+
+
+    @staticmethod
+    def file_identity():
+        """ identifies the database file's contents for the snapshot: the file (a rebuild
+        replaces it) plus its mtime and size, so a deleted and rebuilt database that starts
+        over at the same data version does not match an old snapshot """
+        st = os.stat(SunspotAPI.dbfile)
+        return f'{st.st_dev} {st.st_ino} {st.st_mtime_ns} {st.st_size}'
+
+
+    @staticmethod
+    def data_version():
+        """ data version stamp of the connected database """
+        return SunspotAPI.pool.connection().execute("PRAGMA user_version").fetchone()[0]
+
+
+    @staticmethod
+    def refresh():
+        """ picks up a rebuilt or incrementally updated database; returns the current data version.
+        The database is looked at no more than once per REFRESH_INTERVAL; calls in between
+        return the last version without taking the lock """
+        if time.monotonic() - SunspotAPI.checked < REFRESH_INTERVAL:
+            return SunspotAPI.version
+        with SunspotAPI.refresh_lock:
+            # another thread may have checked while this one waited for the lock
+            if time.monotonic() - SunspotAPI.checked < REFRESH_INTERVAL:
+                return SunspotAPI.version
+            SunspotAPI.checked = time.monotonic()
+            if SunspotAPI.file_stamp() != SunspotAPI.db_stamp:
+                SunspotAPI.connect(SunspotAPI.dbfile, SunspotAPI.in_memory)
+            else:
+                version = SunspotAPI.data_version()
+                if version != SunspotAPI.version:
+                    if SunspotAPI.in_memory:
+                        SunspotAPI.store = SunspotAPI.load(version)
+                    SunspotAPI.version = version
+            return SunspotAPI.version
+
+
+    @staticmethod
+    def load(version):
+        """ loads Date_Fraction and Daily_Sunspot_Total once into contiguous arrays sorted by date,
+        memory-mapping the .npy snapshot written by to_database.py when it matches the database;
+        returns the new Store, which the caller publishes """
+        store = SunspotAPI.load_snapshot(version)
+        if store is None:
+            query = SunspotAPI.select_query(SMOOTHING_COLUMNS, 'Daily_Sunspot_Total > -1 ORDER BY Date_Fraction')
+            df = SunspotAPI.execute(query)
+
+            dates = np.ascontiguousarray(df['Date_Fraction'].to_numpy())
+            totals = np.ascontiguousarray(df['Daily_Sunspot_Total'].to_numpy())
+
+            # calendar days and prefix sums, so any rolling window is one subtraction
+            days = calendar_days(df['Year'], df['Month'], df['Day'])
+            cumsum = np.concatenate([[0], np.cumsum(totals)])
+
+            # slices handed out are shared between callbacks, so keep them read-only
+            for arr in (dates, totals, days, cumsum):
+                arr.flags.writeable = False
+
+            # the aggregate levels are small, so keep all of them as column arrays
+            levels = {}
+            for level in SunspotAPI.available_levels():
+                df = SunspotAPI.execute(f"SELECT {', '.join(LEVEL_COLUMNS)} FROM {level} ORDER BY Date_Fraction")
+                levels[level] = {col: np.ascontiguousarray(df[col].to_numpy()) for col in LEVEL_COLUMNS}
+                for arr in levels[level].values():
+                    arr.flags.writeable = False
+
+            store = Store(version, dates, totals, days, cumsum, levels)
+
+        # the per-decade histograms are a few dozen rows each
+        if 'sunspot_decade_hist' in SunspotAPI.tables():
+            df = SunspotAPI.execute("SELECT Decade, Bin_Start, Bin_End, Count FROM sunspot_decade_hist ORDER BY Decade, Bin_Start")
+            for decade, hist in df.groupby('Decade'):
+                store.hists[decade] = hist.drop(columns='Decade').reset_index(drop=True)
+        return store
+
 
     @staticmethod
-    def connect(dbfile):
-        """ make a connection """
-        SunspotAPI.con = sqlite3.connect(dbfile, check_same_thread=False)
+    def snapshot_dir():
+        """ directory holding the .npy snapshot of the connected database """
+        return SunspotAPI.dbfile + '.snapshot'
 
 
     @staticmethod
-    def execute(query):
-        """ executes query """
-        return pd.read_sql_query(query, SunspotAPI.con)
+    def snapshot_arrays(store):
+        """ name -> array of everything in the store apart from the histograms """
+        arrays = {name: getattr(store, name) for name in SNAPSHOT_ARRAYS}
+        for level, cols in store.levels.items():
+            for col, arr in cols.items():
+                arrays[f'{level}.{col}'] = arr
+        return arrays
 
 
     @staticmethod
-    def get_sunspot_amt():
+    def save_snapshot():
+        """ writes the in-memory store as .npy files tagged with the data version, which
+        worker processes memory-map instead of loading the database themselves """
+        path = SunspotAPI.snapshot_dir()
+        os.makedirs(path, exist_ok=True)
+        store = SunspotAPI.store
+        version = store.version
+
+        for name, arr in SunspotAPI.snapshot_arrays(store).items():
+            tmpfile = os.path.join(path, f'{version}.{name}.tmp.npy')
+            np.save(tmpfile, arr)
+            os.replace(tmpfile, os.path.join(path, f'{version}.{name}.npy'))
+
+        # readers only trust a version once its marker exists, and only for the database
+        # file it names
+        with open(os.path.join(path, f'{version}.ok'), 'w') as f:
+            f.write(SunspotAPI.file_identity())
+
+        # dropping older versions is safe: processes still mapping them keep the open files
+        for filename in os.listdir(path):
+            if not filename.startswith(f'{version}.'):
+                os.remove(os.path.join(path, filename))
+
+
+    @staticmethod
+    def load_snapshot(version):
+        """ memory-maps the snapshot matching the data version and database file into a Store;
+        None if there is none """
+        path = SunspotAPI.snapshot_dir()
+        try:
+            with open(os.path.join(path, f'{version}.ok')) as f:
+                if f.read() != SunspotAPI.file_identity():
+                    return None
+        except FileNotFoundError:
+            return None
+
+        def mapped(name):
+            # mmap_mode='r' gives read-only arrays backed by the shared page cache
+            return np.load(os.path.join(path, f'{version}.{name}.npy'), mmap_mode='r')
+
+        try:
+            arrays = {name: mapped(name) for name in SNAPSHOT_ARRAYS}
+            levels = {level: {col: mapped(f'{level}.{col}') for col in LEVEL_COLUMNS}
+                      for level in SunspotAPI.available_levels()}
+        except FileNotFoundError:
+            return None
+
+        return Store(version, levels=levels, **arrays)
+
+
+    @staticmethod
+    def execute(query, params=None):
+        """ executes query with optional bound parameters """
+        with STATS.timer('SunspotAPI.execute'):
+            return pd.read_sql_query(query, SunspotAPI.pool.connection(), params=params)
+
+
+    @staticmethod
+    def select_query(columns, where):
+        """ builds (once) the SELECT text for a column projection and WHERE clause """
+        key = (tuple(columns), where)
+        query = SunspotAPI.queries.get(key)
+        if query is None:
+            # column names cannot be bound, so only known columns are allowed
+            unknown = set(columns) - set(COLUMNS)
+            if unknown:
+                raise ValueError(f"unknown sunspot columns: {sorted(unknown)}")
+            query = f"SELECT {', '.join(columns)} FROM sunspot WHERE {where}"
+            SunspotAPI.queries[key] = query
+        return query
+
+
+    @staticmethod
+    def tables():
+        """ names of the tables in the connected database """
+        tables = SunspotAPI.pool.connection().execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        return {name for (name,) in tables}
+
+
+    @staticmethod
+    def available_levels():
+        """ aggregate tables present in the connected database, coarsest first """
+        tables = SunspotAPI.tables()
+        return [level for level in LEVELS if level != 'sunspot' and level in tables]
+
+
+    @staticmethod
+    def get_sunspot_amt(columns=COLUMNS):
         """ gets data for amount of sunspots """
-        query = "SELECT * FROM sunspot WHERE Daily_Sunspot_Total > -1"
+        query = SunspotAPI.select_query(columns, 'Daily_Sunspot_Total > -1')
         df = SunspotAPI.execute(query)
         return df
 
 
     @staticmethod
-    def get_sunspot_amt_range(start_date, end_date):
+    def get_sunspot_arrays_range(start_date, end_date):
+        """ gets zero-copy (dates, totals) slices strictly between start_date and end_date """
+        store = SunspotAPI.store
+        lo = np.searchsorted(store.dates, start_date, side='right')
+        hi = np.searchsorted(store.dates, end_date, side='left')
+        return store.dates[lo:hi], store.totals[lo:hi]
+
+
+    @staticmethod
+    def get_sunspot_amt_range(start_date, end_date, columns=CHART_COLUMNS):
         """ gets data for amount of sunspots over specified range """
-        query = f"SELECT * FROM sunspot WHERE Date_Fraction > {start_date} AND Date_Fraction < {end_date} and Daily_Sunspot_Total > -1"
-        df = SunspotAPI.execute(query)
+        if SunspotAPI.store.dates is not None and set(columns) <= set(CHART_COLUMNS):
+            dates, totals = SunspotAPI.get_sunspot_arrays_range(start_date, end_date)
+            df = pd.DataFrame({'Date_Fraction': dates, 'Daily_Sunspot_Total': totals}, copy=False)
+            return df[list(columns)]
+
+        query = SunspotAPI.select_query(columns, 'Date_Fraction > ? AND Date_Fraction < ? AND Daily_Sunspot_Total > -1')
+        df = SunspotAPI.execute(query, (start_date, end_date))
         return df
-    
+
+
+    @staticmethod
+    def shared(name, key, load, max_entries):
+        """ value of key in the LRU store SunspotAPI.<name>, made once by load() and shared by
+        every caller asking for it; concurrent callers wait for the first one's load """
+        store = getattr(SunspotAPI, name)
+        with SunspotAPI.range_lock:
+            value = store.get(key)
+            if value is not None:
+                store.move_to_end(key)
+                return value
+            loading = SunspotAPI.pending.get((name, key))
+            if loading is None:
+                SunspotAPI.pending[(name, key)] = threading.Event()
+
+        if loading is not None:
+            loading.wait()
+            value = store.get(key)
+            if value is not None:
+                return value
+            return SunspotAPI.shared(name, key, load, max_entries)
+
+        try:
+            value = load()
+            with SunspotAPI.range_lock:
+                store[key] = value
+                while len(store) > max_entries:
+                    store.popitem(last=False)
+            return value
+        finally:
+            with SunspotAPI.range_lock:
+                SunspotAPI.pending.pop((name, key)).set()
+
+
+    @staticmethod
+    def get_shared_range(start_date, end_date):
+        """ gets a read-only daily range loaded once per (range, data version) and shared by every
+        callback asking for it; concurrent callers wait for the first one's load """
+        def load():
+            df = SunspotAPI.get_sunspot_amt_range(start_date, end_date)
+
+            # columns become read-only arrays, so no caller can change what the others see
+            columns = {}
+            for col in df.columns:
+                arr = df[col].to_numpy()
+                if arr.flags.writeable:
+                    arr = arr.copy()
+                    arr.flags.writeable = False
+                columns[col] = arr
+            return pd.DataFrame(columns, copy=False)
+
+        # the version is read before the store and published after it, so an entry never
+        # holds data older than its key
+        key = (start_date, end_date, SunspotAPI.version)
+        return SunspotAPI.shared('ranges', key, load, RANGE_CACHE_SIZE)
+
+
+    @staticmethod
+    def get_smoothed_range(start_date, end_date, months):
+        """ gets Date_Fraction and the trailing mean of Daily_Sunspot_Total over `months`
+        calendar months for the range; windows reach back before start_date """
+        store = SunspotAPI.store
+        if store.dates is not None:
+            # one smoothed series per window over all days, sliced per range
+            smoothed = store.smoothed.get(months)
+            if smoothed is None:
+                smoothed = rolling_mean_months(store.days, store.cumsum, months)
+                smoothed.flags.writeable = False
+                store.smoothed[months] = smoothed
+
+            lo = np.searchsorted(store.dates, start_date, side='right')
+            hi = np.searchsorted(store.dates, end_date, side='left')
+            return pd.DataFrame({'Date_Fraction': store.dates[lo:hi], 'Smoothed': smoothed[lo:hi]}, copy=False)
+
+        # without the in-memory store, smooth a range padded by the window
+        df = SunspotAPI.get_sunspot_amt_range(start_date - months / 12 - 1, end_date, SMOOTHING_COLUMNS)
+        days = calendar_days(df['Year'], df['Month'], df['Day'])
+        cumsum = np.concatenate([[0], np.cumsum(df['Daily_Sunspot_Total'].to_numpy())])
+        df = pd.DataFrame({'Date_Fraction': df['Date_Fraction'], 'Smoothed': rolling_mean_months(days, cumsum, months)})
+        return df[df['Date_Fraction'] > start_date].reset_index(drop=True)
+
+
+    @staticmethod
+    def pick_level(start_date, end_date, min_points=CHART_POINTS):
+        """ coarsest level that still has at least min_points rows over the span """
+        span = end_date - start_date
+        levels = SunspotAPI.store.levels or SunspotAPI.available_levels()
+        for level in levels:
+            if span * LEVELS[level] >= min_points:
+                return level
+        return 'sunspot'
+
+
+    @staticmethod
+    def get_level_range(level, start_date, end_date):
+        """ gets one aggregate level over the range, with the period mean as Daily_Sunspot_Total """
+        levels = SunspotAPI.store.levels
+        if level in levels:
+            cols = levels[level]
+            lo = np.searchsorted(cols['Date_Fraction'], start_date, side='right')
+            hi = np.searchsorted(cols['Date_Fraction'], end_date, side='left')
+            df = pd.DataFrame({col: arr[lo:hi] for col, arr in cols.items()}, copy=False)
+        else:
+            if level not in LEVELS:
+                raise ValueError(f"unknown sunspot level: {level}")
+            query = f"SELECT {', '.join(LEVEL_COLUMNS)} FROM {level} WHERE Date_Fraction > ? AND Date_Fraction < ?"
+            df = SunspotAPI.execute(query, (start_date, end_date))
+        return df.rename(columns={'Mean': 'Daily_Sunspot_Total'})
+
+
+    @staticmethod
+    def get_sunspot_series(start_date, end_date, min_points=CHART_POINTS):
+        """ gets (level, data) for the range from the coarsest level that still gives min_points rows """
+        level = SunspotAPI.pick_level(start_date, end_date, min_points)
+        if level == 'sunspot':
+            return level, SunspotAPI.get_shared_range(start_date, end_date)
+        return level, SunspotAPI.get_level_range(level, start_date, end_date)
+
+
+    @staticmethod
+    def get_decade_histogram(decade):
+        """ gets the precomputed (Bin_Start, Bin_End, Count) histogram of daily totals for a decade """
+        hists = SunspotAPI.store.hists
+        if hists:
+            return hists.get(decade, pd.DataFrame(columns=['Bin_Start', 'Bin_End', 'Count']))
+
+        if 'sunspot_decade_hist' in SunspotAPI.tables():
+            query = "SELECT Bin_Start, Bin_End, Count FROM sunspot_decade_hist WHERE Decade = ? ORDER BY Bin_Start"
+            return SunspotAPI.execute(query, (decade,))
+
+        # databases built before the pyramid: bin the decade's daily rows here
+        totals = SunspotAPI.get_sunspot_amt_range(decade, decade + 10)['Daily_Sunspot_Total'].to_numpy()
+        counts = np.bincount((totals // HIST_BIN_WIDTH).astype(np.intp))
+        bins = np.flatnonzero(counts)
+        return pd.DataFrame({
+            'Bin_Start': bins * HIST_BIN_WIDTH,
+            'Bin_End': (bins + 1) * HIST_BIN_WIDTH,
+            'Count': counts[bins],
+        })
+
+
+    @staticmethod
+    def get_cycle_folds(start_date, end_date):
+        """ folds the range at every CYCLE_PERIODS step: a (period, count bin, phase bin) density
+        plus each period's fold strength, the share of variance explained by phase; made once
+        per (range, data version) and shared like get_shared_range """
+        key = (start_date, end_date, SunspotAPI.version)
+        return SunspotAPI.shared('folds', key, lambda: SunspotAPI.fold(start_date, end_date), FOLD_CACHE_SIZE)
+
+
+    @staticmethod
+    def fold(start_date, end_date):
+        """ computes the folds of get_cycle_folds, one period at a time so the temporaries
+        stay at a few day-length arrays """
+        df = SunspotAPI.get_shared_range(start_date, end_date)
+        dates = df['Date_Fraction'].to_numpy()
+        totals = df['Daily_Sunspot_Total'].to_numpy()
+
+        n_counts = int(totals.max() // HIST_BIN_WIDTH) + 1 if len(totals) else 1
+        density = np.zeros((len(CYCLE_PERIODS), n_counts, PHASE_BINS), dtype=np.int64)
+        strength = np.zeros(len(CYCLE_PERIODS))
+
+        # an empty range has nothing to fold and no variance to explain
+        if len(totals):
+            count = (totals // HIST_BIN_WIDTH).astype(np.int32)
+            mean = totals.mean()
+            variance = len(totals) * totals.var()
+
+            for i, period in enumerate(CYCLE_PERIODS):
+                phase = np.minimum((dates % period / period * PHASE_BINS).astype(np.int32), PHASE_BINS - 1)
+                density[i] = np.bincount(count * PHASE_BINS + phase,
+                                         minlength=n_counts * PHASE_BINS).reshape(n_counts, PHASE_BINS)
+
+                # fold strength: between-phase-bin variance of the mean total over the total variance
+                n = np.bincount(phase, minlength=PHASE_BINS)
+                sums = np.bincount(phase, weights=totals, minlength=PHASE_BINS)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    bin_means = np.where(n > 0, sums / n, mean)
+                    strength[i] = (n * (bin_means - mean) ** 2).sum() / variance
+
+        return {
+            'periods': CYCLE_PERIODS,
+            'count_edges': np.arange(n_counts + 1) * HIST_BIN_WIDTH,
+            'density': density,
+            'strength': np.nan_to_num(strength),
+        }
+
+
+    @staticmethod
+    def get_cycle_density(start_date, end_date, cycle_period):
+        """ gets (phase centers in years, count bin centers, counts) of the range folded at cycle_period """
+        folds = SunspotAPI.get_cycle_folds(start_date, end_date)
+        step = int(np.clip(round((cycle_period - CYCLE_PERIODS[0]) * 10), 0, len(CYCLE_PERIODS) - 1))
+        period = CYCLE_PERIODS[step]
+
+        phase = (np.arange(PHASE_BINS) + 0.5) / PHASE_BINS * period
+        edges = folds['count_edges']
+        counts = (edges[:-1] + edges[1:]) / 2
+        return phase, counts, folds['density'][step]
+
+
+    @staticmethod
+    def downsample(df, y, max_points=CHART_POINTS):
+        """ LTTB-downsamples df to at most max_points rows along Date_Fraction, keeping the peaks of column y """
+        df = df[df[y].notna()]
+        idx = lttb_indices(df['Date_Fraction'].to_numpy(), df[y].to_numpy(), max_points)
+        return df.iloc[idx]
@@ -0,0 +1,186 @@
+"""
+File: sunspot_bench.py
+Description: replays slider traces against the dashboard and reports throughput and latency
+
+Usage:
+    python sunspot_bench.py                          # synthetic slider drags
+    python sunspot_bench.py --save-trace drags.json  # keep the generated trace
+    python sunspot_bench.py --trace drags.json --threads 4 --out result.json
+    python sunspot_bench.py --trace drags.json --baseline result.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+from sunspot import create_app, FIGURE_CACHE_BYTES
+from sunspot_stats import STATS
+
+# callback output -> the inputs dash sends with it
+CALLBACKS = {
+    'sunspot-graph.figure': ['year_range', 'smoothing_period'],
+    'cycle-graph.figure': ['year_range', 'cycle_period'],
+    'sun-image.src': ['image-dropdown'],
+    'sunspot-histogram.figure': ['decade-dropdown'],
+}
+
+# the inputs each slider or dropdown move triggers
+TRIGGERS = {
+    'year_range': ['sunspot-graph.figure', 'cycle-graph.figure'],
+    'smoothing_period': ['sunspot-graph.figure'],
+    'cycle_period': ['cycle-graph.figure'],
+    'decade-dropdown': ['sunspot-histogram.figure'],
+}
+
+DEFAULTS = {
+    'year_range': [1800, 2000],
+    'smoothing_period': 12,
+    'cycle_period': 11.0,
+    'image-dropdown': 'SOHO EIT 171',
+    'decade-dropdown': 1820,
+}
+
+def synthetic_trace(n_moves=200, seed=0):
+    """ slider drags as a browser sends them: runs of small steps on one control """
+    rng = random.Random(seed)
+    state = dict(DEFAULTS)
+    trace = []
+    while len(trace) < n_moves:
+        control = rng.choice(list(TRIGGERS))
+        for _ in range(rng.randint(3, 12)):
+            if control == 'year_range':
+                lo, hi = state['year_range']
+                lo = min(max(1800, lo + rng.randint(-5, 5)), 1990)
+                hi = max(min(2000, hi + rng.randint(-5, 5)), lo + 10)
+                state['year_range'] = [lo, hi]
+            elif control == 'smoothing_period':
+                state['smoothing_period'] = min(max(1, state['smoothing_period'] + rng.choice([-1, 1])), 24)
+            elif control == 'cycle_period':
+                step = round(state['cycle_period'] * 10) + rng.choice([-1, 1])
+                state['cycle_period'] = min(max(90, step), 150) / 10
+            else:
+                state['decade-dropdown'] = rng.choice(range(1820, 2020, 10))
+            trace.append({'control': control, 'state': dict(state)})
+    return trace[:n_moves]
+
+
+def payload(output, state):
+    """ the json body dash posts to /_dash-update-component """
+    component, prop = output.split('.')
+    return {
+        'output': output,
+        'outputs': {'id': component, 'property': prop},
+        'inputs': [{'id': name, 'property': 'value', 'value': state[name]} for name in CALLBACKS[output]],
+        'changedPropIds': [f'{name}.value' for name in CALLBACKS[output]],
+        'state': [],
+    }
+
+
+def replay(app, trace, threads=1):
+    """ replays the trace, split round-robin over threads; returns per-output latencies and wall time """
+    latencies = {output: [] for output in CALLBACKS}
+    lock = threading.Lock()
+
+    def worker(events):
+        client = app.server.test_client()
+        for event in events:
+            for output in TRIGGERS[event['control']]:
+                start = time.perf_counter()
+                resp = client.post('/_dash-update-component', json=payload(output, event['state']))
+                elapsed = time.perf_counter() - start
+                if resp.status_code != 200:
+                    raise RuntimeError(f'{output} failed with {resp.status_code}')
+                with lock:
+                    latencies[output].append(elapsed)
+
+    workers = [threading.Thread(target=worker, args=(trace[i::threads],)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return latencies, time.perf_counter() - start
+
+
+def report(latencies, wall):
+    """ throughput plus per-output and overall latency percentiles in ms """
+    every = np.concatenate([np.array(v) for v in latencies.values() if v]) * 1000
+    result = {'requests': len(every), 'seconds': wall, 'throughput': len(every) / wall, 'callbacks': {}}
+    for output, values in list(latencies.items()) + [('all', every / 1000)]:
+        if len(values) == 0:
+            continue
+        ms = np.array(values) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        result['callbacks'][output] = {'count': len(ms), 'p50': p50, 'p95': p95, 'p99': p99}
+    result['stages'] = STATS.summary()
+    return result
+
+
+def regressions(result, baseline, threshold):
+    """ callbacks whose p50 or p95 grew by more than threshold (a fraction) over the baseline """
+    found = []
+    for output, now in result['callbacks'].items():
+        before = baseline.get('callbacks', {}).get(output)
+        if before is None:
+            continue
+        for key in ['p50', 'p95']:
+            if now[key] > before[key] * (1 + threshold):
+                found.append(f'{output} {key}: {before[key]:.2f} ms -> {now[key]:.2f} ms')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay slider traces against the sundash callbacks')
+    parser.add_argument('--db', default='sunspot.db')
+    parser.add_argument('--trace', help='json trace to replay (default: a synthetic one)')
+    parser.add_argument('--save-trace', help='write the replayed trace here')
+    parser.add_argument('--moves', type=int, default=200, help='length of the synthetic trace')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--cache', action='store_true', help='keep the figure cache on')
+    parser.add_argument('--out', help='write the json result here')
+    parser.add_argument('--baseline', help='json result of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown over the baseline')
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace) as f:
+            trace = json.load(f)
+    else:
+        trace = synthetic_trace(args.moves)
+    if args.save_trace:
+        with open(args.save_trace, 'w') as f:
+            json.dump(trace, f)
+
+    app = create_app(args.db, cache_bytes=FIGURE_CACHE_BYTES if args.cache else 0, live_images=False)
+
+    # warm up imports and the in-memory store before measuring
+    replay(app, trace[:5])
+    STATS.reset()
+
+    latencies, wall = replay(app, trace, args.threads)
+    result = report(latencies, wall)
+
+    print(f"{result['requests']} requests in {wall:.2f} s: {result['throughput']:.1f} req/s")
+    for output, row in result['callbacks'].items():
+        print(f"  {output:28} n={row['count']:5}  p50={row['p50']:8.2f}  p95={row['p95']:8.2f}  p99={row['p99']:8.2f} ms")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.threshold)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
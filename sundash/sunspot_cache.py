@@ -0,0 +1,83 @@
+"""
+File: sunspot_cache.py
+Description: bounded LRU cache of serialized Plotly figures for the dashboard callbacks
+"""
+
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+class FigureCache:
+    """ LRU cache of figure JSON keyed by callback name, inputs and data version,
+    evicting least recently used figures once max_bytes is exceeded """
+
+    def __init__(self, max_bytes=64 * 2**20, latency=None):
+        """ Constructor """
+        self.max_bytes = max_bytes
+        self.latency = latency
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ cached JSON for key, or None """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """ stores JSON for key, evicting old entries to stay under max_bytes """
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self.entries[key] = value
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def clear(self):
+        """ drops every entry """
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """ entry count, size and hit/miss counters """
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.nbytes,
+                    'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+    def memoize(self, version):
+        """ decorator caching a figure callback; version() returns the current data version """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                # dash passes ranges as lists, which are not hashable
+                inputs = tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args)
+                key = (func.__name__, inputs, version())
+
+                value = self.get(key)
+                if value is None:
+                    fig = func(*args)
+                    start = time.perf_counter()
+                    value = fig.to_json()
+                    if self.latency is not None:
+                        self.latency.record(f'{func.__name__}.serialize', time.perf_counter() - start)
+                    self.put(key, value)
+                return json.loads(value)
+            return wrapper
+        return decorator
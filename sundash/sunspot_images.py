@@ -0,0 +1,183 @@
+"""
+File: sunspot_images.py
+Description: server-side caching proxy for the live SOHO images shown by the dashboard
+"""
+
+import hashlib
+import io
+import threading
+import time
+import traceback
+from http.client import HTTPException
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from flask import Response, abort, request
+
+# Pillow is only needed for thumbnails
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+class ImageProxy:
+    """ fetches every image on a background schedule and serves all clients from
+    one local copy, revalidating upstream with ETag/Last-Modified; requests never
+    wait on upstream once a copy exists """
+
+    def __init__(self, urls, ttl=300, thumb_size=256, timeout=10, retry=30):
+        """ Constructor """
+        self.urls = dict(urls)
+        self.ttl = ttl
+        self.thumb_size = thumb_size
+        self.timeout = timeout
+        self.retry = retry
+        self.entries = {}
+        self.lock = threading.Lock()
+        # one fetch per image at a time, and no new attempt until retry_at after a failure
+        self.fetching = {name: threading.Lock() for name in self.urls}
+        self.retry_at = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def fetch(self, name):
+        """ (re)fetches one image, sending the cached validators so an unchanged
+        image costs a 304; keeps serving the old copy if upstream fails, and
+        backs off for retry seconds """
+        url = self.urls[name]
+        old = self.entries.get(name)
+
+        headers = {}
+        if old is not None:
+            if old['etag']:
+                headers['If-None-Match'] = old['etag']
+            if old['last_modified']:
+                headers['If-Modified-Since'] = old['last_modified']
+
+        try:
+            with urlopen(Request(url, headers=headers), timeout=self.timeout) as resp:
+                entry = {
+                    'body': resp.read(),
+                    'content_type': resp.headers.get('Content-Type', 'image/jpeg'),
+                    'etag': resp.headers.get('ETag'),
+                    'last_modified': resp.headers.get('Last-Modified'),
+                    'thumbnail': None,
+                }
+        except HTTPError as err:
+            if err.code != 304 or old is None:
+                self.retry_at[name] = time.monotonic() + self.retry
+                return old
+            entry = old
+        except (URLError, OSError, HTTPException):
+            # HTTPException covers a body cut short (IncompleteRead) or a garbled response
+            self.retry_at[name] = time.monotonic() + self.retry
+            return old
+
+        if entry is not old:
+            entry['tag'] = hashlib.md5(entry['body']).hexdigest()
+        entry['fetched'] = time.monotonic()
+        with self.lock:
+            self.entries[name] = entry
+        return entry
+
+    def backing_off(self, name):
+        """ whether the last fetch of name failed less than retry seconds ago """
+        return time.monotonic() < self.retry_at.get(name, 0)
+
+    def get(self, name):
+        """ cached entry for name. With no copy yet, one caller fetches it and concurrent
+        callers wait for that fetch; a stale copy is served as is while it is refetched
+        in the background """
+        entry = self.entries.get(name)
+        if entry is None:
+            with self.fetching[name]:
+                entry = self.entries.get(name)
+                if entry is None and not self.backing_off(name):
+                    entry = self.fetch(name)
+        elif time.monotonic() - entry['fetched'] > self.ttl and self.thread is None:
+            self.refresh_soon(name)
+        return entry
+
+    def refresh_soon(self, name):
+        """ refetches name on a short-lived thread unless a fetch is already running or backing off """
+        lock = self.fetching[name]
+        if self.backing_off(name) or not lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.fetch(name)
+            finally:
+                lock.release()
+        threading.Thread(target=run, name=f'image-fetch {name}', daemon=True).start()
+
+    def thumbnail(self, entry):
+        """ JPEG thumbnail of an entry at most thumb_size wide/high, made once per fetch """
+        if entry['thumbnail'] is None:
+            img = Image.open(io.BytesIO(entry['body']))
+            img.thumbnail((self.thumb_size, self.thumb_size))
+            out = io.BytesIO()
+            img.convert('RGB').save(out, format='JPEG')
+            entry['thumbnail'] = out.getvalue()
+        return entry['thumbnail']
+
+    def refresh_all(self):
+        """ refetches every image; an unexpected error backs that image off instead of
+        ending the background loop, which get() relies on while the thread is set """
+        for name in self.urls:
+            with self.fetching[name]:
+                try:
+                    self.fetch(name)
+                except Exception:
+                    traceback.print_exc()
+                    self.retry_at[name] = time.monotonic() + self.retry
+
+    def run(self):
+        """ background loop: refresh every image once per ttl until stopped """
+        while not self.stopped.is_set():
+            self.refresh_all()
+            self.stopped.wait(self.ttl)
+
+    def start(self):
+        """ starts the background refresh thread """
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name='image-proxy', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """ stops the background refresh thread """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def url_for(self, name, thumbnail=False):
+        """ local url the browser should load for name """
+        url = f"/sun-image/{quote(name, safe='')}"
+        return url + '?thumb=1' if thumbnail else url
+
+    def register(self, server):
+        """ adds the /sun-image/<name> route to the dash app's flask server """
+        def serve_image(name):
+            if name not in self.urls:
+                abort(404)
+            entry = self.get(name)
+            if entry is None:
+                abort(502)
+
+            body = entry['body']
+            mimetype = entry['content_type']
+            tag = entry['tag']
+            if request.args.get('thumb') and Image is not None:
+                body = self.thumbnail(entry)
+                mimetype = 'image/jpeg'
+                tag += '-thumb'
+
+            resp = Response(body, mimetype=mimetype)
+            resp.set_etag(tag)
+            resp.cache_control.max_age = self.ttl
+            return resp.make_conditional(request)
+
+        server.add_url_rule('/sun-image/<path:name>', 'sun_image', serve_image)
@@ -0,0 +1,83 @@
+"""
+File: sunspot_stats.py
+Description: latency instrumentation for the dashboard callbacks and the API
+"""
+
+import functools
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+from flask import jsonify
+
+# upper edges (ms) of the latency histogram buckets; the last bucket is open
+BUCKETS_MS = (0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000, 3000)
+
+class LatencyStats:
+    """ keeps the most recent max_samples durations per named stage """
+
+    def __init__(self, max_samples=10000):
+        """ Constructor """
+        self.max_samples = max_samples
+        self.samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        """ adds one duration for stage name """
+        with self.lock:
+            self.samples[name].append(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """ times the enclosed block as stage name """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """ decorator timing every call of a function as stage name """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """ per stage: count, mean, p50/p95/p99 and histogram counts, all in ms """
+        with self.lock:
+            samples = {name: np.array(values) * 1000 for name, values in self.samples.items()}
+
+        stats = {}
+        for name, ms in sorted(samples.items()):
+            if len(ms) == 0:
+                continue
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            counts = np.bincount(np.searchsorted(BUCKETS_MS, ms), minlength=len(BUCKETS_MS) + 1)
+            stats[name] = {
+                'count': len(ms),
+                'mean': float(ms.mean()),
+                'p50': float(p50),
+                'p95': float(p95),
+                'p99': float(p99),
+                'histogram': dict(zip([f'<{b}' for b in BUCKETS_MS] + [f'>={BUCKETS_MS[-1]}'], counts.tolist())),
+            }
+        return stats
+
+    def reset(self):
+        """ drops every sample """
+        with self.lock:
+            self.samples.clear()
+
+    def register(self, server, route='/stats'):
+        """ adds a JSON stats endpoint to the dash app's flask server """
+        server.add_url_rule(route, 'latency_stats', lambda: jsonify(self.summary()))
+
+
+# shared by the API and the dashboard callbacks of this process
+STATS = LatencyStats()
@@ -0,0 +1,175 @@
+"""
+File: test_sunspot_images.py
+Description: tests of the image proxy against a local stand-in for the SOHO server
+
+Usage:
+    python -m pytest test_sunspot_images.py   (or python -m unittest test_sunspot_images)
+"""
+
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flask import Flask
+
+from sunspot_images import ImageProxy
+
+BODY = b'\xff\xd8 not really a jpeg \xff\xd9'
+ETAG = '"v1"'
+
+class StandIn(BaseHTTPRequestHandler):
+    """ serves BODY with an ETag; the server's mode makes it fail, hang or cut the body short instead """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(dict(self.headers))
+        if server.mode == 'hang':
+            server.release.wait(5)
+        if server.mode == 'fail':
+            self.send_response(500)
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == ETAG and server.mode != 'short':
+            self.send_response(304)
+            self.end_headers()
+            return
+        time.sleep(server.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('ETag', ETAG)
+        if server.mode == 'short':
+            # promise more than is sent, so the client's read ends in IncompleteRead
+            self.send_header('Content-Length', str(2 * len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+            self.close_connection = True
+            return
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.mode = 'ok'
+        self.server.delay = 0
+        self.server.release = threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        url = f'http://127.0.0.1:{self.server.server_address[1]}/latest.jpg'
+        self.proxy = ImageProxy({'EIT 171': url}, ttl=60, timeout=1, retry=60)
+
+    def tearDown(self):
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait_for_requests(self, n, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.server.requests) < n and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_fetch_and_revalidate(self):
+        entry = self.proxy.get('EIT 171')
+        self.assertEqual(entry['body'], BODY)
+        self.assertEqual(entry['etag'], ETAG)
+
+        # an unchanged image is revalidated with the cached ETag and kept
+        again = self.proxy.fetch('EIT 171')
+        self.assertIs(again, entry)
+        self.assertEqual(self.server.requests[-1].get('If-None-Match'), ETAG)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_cached_copy_served_without_upstream(self):
+        self.proxy.get('EIT 171')
+        for _ in range(20):
+            self.assertEqual(self.proxy.get('EIT 171')['body'], BODY)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_concurrent_first_requests_fetch_once(self):
+        self.server.delay = 0.2
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.proxy.get('EIT 171'))) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertTrue(all(entry['body'] == BODY for entry in results))
+
+    def test_stale_copy_served_while_upstream_hangs(self):
+        self.proxy.get('EIT 171')
+        self.proxy.entries['EIT 171']['fetched'] -= 120
+        self.server.mode = 'hang'
+
+        start = time.monotonic()
+        for _ in range(5):
+            self.assertEqual(self.proxy.get('EIT 171')['body'], BODY)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+        # the stale copy triggers one background refetch, not one per request
+        self.wait_for_requests(2)
+        time.sleep(0.1)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_failure_backs_off(self):
+        self.server.mode = 'fail'
+        self.assertIsNone(self.proxy.get('EIT 171'))
+        self.assertIsNone(self.proxy.get('EIT 171'))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_incomplete_body_keeps_old_copy(self):
+        entry = self.proxy.get('EIT 171')
+        self.server.mode = 'short'
+        self.assertIs(self.proxy.fetch('EIT 171'), entry)
+        self.assertTrue(self.proxy.backing_off('EIT 171'))
+
+    def test_background_loop_survives_upstream_errors(self):
+        self.server.mode = 'short'
+        self.proxy.ttl = 0.05
+        self.proxy.retry = 0
+        self.proxy.start()
+        try:
+            self.wait_for_requests(3)
+            self.assertTrue(self.proxy.thread.is_alive())
+            self.server.mode = 'ok'
+            self.wait_for_requests(len(self.server.requests) + 1)
+            time.sleep(0.1)
+            self.assertEqual(self.proxy.entries['EIT 171']['body'], BODY)
+        finally:
+            self.proxy.stop()
+
+    def test_route(self):
+        app = Flask(__name__)
+        self.proxy.register(app)
+        client = app.test_client()
+
+        resp = client.get(self.proxy.url_for('EIT 171'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, BODY)
+        self.assertEqual(resp.headers['Cache-Control'], 'max-age=60')
+
+        resp = client.get(self.proxy.url_for('EIT 171'), headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(client.get('/sun-image/unknown').status_code, 404)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_route_upstream_down(self):
+        self.server.mode = 'fail'
+        app = Flask(__name__)
+        self.proxy.register(app)
+        self.assertEqual(app.test_client().get(self.proxy.url_for('EIT 171')).status_code, 502)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,32 +3,244 @@ File: to_database.py
 Description: takes a csv file and turns it into a .db
 """
 
+import argparse
+import os
+import numpy as np
 import pandas as pd
 import sqlite3
+from sunspot_api import COLUMNS, HIST_BIN_WIDTH, SunspotAPI
 
-# Read CSV file into DataFrame
-# Add column names!!
-df = pd.read_csv('sunspot.csv', 
-        names=['Year', 
-               'Month', 
-               'Day', 
-               'Date_Fraction', 
-               'Daily_Sunspot_Total', 
-               'Daily_Standard_Deviation', 
-               'Observations', 
-               'Def_prov'
-        ]
+def read_csv(filename, chunksize=None):
+    """ reads the ;-separated SILSO daily file into a DataFrame, or an iterator of chunks """
+    # Add column names!!
+    return pd.read_csv(filename, 
+            sep=';',
+            names=list(COLUMNS),
+            chunksize=chunksize
+        )
+
+
+def insert_rows(conn, table, df):
+    """ inserts df into table inside the caller's transaction (to_sql commits on its own) """
+    cols = ', '.join(df.columns)
+    marks = ', '.join('?' * len(df.columns))
+    rows = df.astype(object).itertuples(index=False, name=None)
+    conn.executemany(f"INSERT INTO {table} ({cols}) VALUES ({marks})", rows)
+
+
+def aggregate(df, keys):
+    """ mean, min, max, count and std of the daily totals per group of keys """
+    grouped = df.groupby(keys)
+    agg = grouped.agg(
+        Date_Fraction=('Date_Fraction', 'mean'),
+        Mean=('Daily_Sunspot_Total', 'mean'),
+        Min=('Daily_Sunspot_Total', 'min'),
+        Max=('Daily_Sunspot_Total', 'max'),
+        Count=('Daily_Sunspot_Total', 'count'),
     )
- 
-# Connect to SQLite database
-conn = sqlite3.connect('sunspot.db')
+    agg['Std'] = grouped['Daily_Sunspot_Total'].std(ddof=0)
+    return agg.reset_index()
+
+
+def decade_histograms(df):
+    """ counts of daily totals per decade in fixed-width bins shared by all decades;
+    only non-empty bins are stored """
+    decades = np.unique(df['Decade'])
+    n_bins = int(df['Daily_Sunspot_Total'].max() // HIST_BIN_WIDTH) + 1
+
+    # one bincount over the combined (decade, bin) index
+    decade_idx = np.searchsorted(decades, df['Decade'])
+    bin_idx = df['Daily_Sunspot_Total'].to_numpy() // HIST_BIN_WIDTH
+    counts = np.bincount(decade_idx * n_bins + bin_idx, minlength=len(decades) * n_bins)
+
+    bin_start = np.arange(n_bins) * HIST_BIN_WIDTH
+    hist = pd.DataFrame({
+        'Decade': np.repeat(decades, n_bins),
+        'Bin_Start': np.tile(bin_start, len(decades)),
+        'Bin_End': np.tile(bin_start + HIST_BIN_WIDTH, len(decades)),
+        'Count': counts,
+    })
+    return hist[hist['Count'] > 0].reset_index(drop=True)
+
+
+# aggregate table -> the column its periods are keyed by, for partial refreshes
+PYRAMID_KEYS = {
+    'sunspot_monthly': 'Year',
+    'sunspot_yearly': 'Year',
+    'sunspot_decade': 'Decade',
+    'sunspot_decade_hist': 'Decade',
+}
+
+
+def pyramid_tables(df):
+    """ monthly, yearly and decade aggregates plus per-decade histograms of the daily rows """
+    valid = df[df['Daily_Sunspot_Total'] > -1].copy()
+    valid['Decade'] = valid['Year'] // 10 * 10
+
+    return {
+        'sunspot_monthly': aggregate(valid, ['Year', 'Month']),
+        'sunspot_yearly': aggregate(valid, ['Year']),
+        'sunspot_decade': aggregate(valid, ['Decade']),
+        'sunspot_decade_hist': decade_histograms(valid),
+    }
+
+
+def build_pyramid(df, conn):
+    """ writes the monthly, yearly and decade aggregate tables plus per-decade histograms """
+    for name, table in pyramid_tables(df).items():
+        table.to_sql(name, conn, if_exists='replace', index=False)
+
+    for name in ['sunspot_monthly', 'sunspot_yearly', 'sunspot_decade']:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_date ON {name} (Date_Fraction)")
+    conn.execute("CREATE INDEX IF NOT EXISTS sunspot_decade_hist_decade ON sunspot_decade_hist (Decade)")
+
+
+def refresh_pyramid(conn, since_year):
+    """ recomputes every aggregate period from the decade containing since_year onwards """
+    decade = since_year // 10 * 10
+    df = pd.read_sql_query("SELECT * FROM sunspot WHERE Year >= ?", conn, params=(decade,))
+    for name, table in pyramid_tables(df).items():
+        key = PYRAMID_KEYS[name]
+        conn.execute(f"DELETE FROM {name} WHERE {key} >= ?", (decade,))
+        insert_rows(conn, name, table)
+
+
+def full_build(csvfile, dbfile):
+    """ rebuilds the whole database next to dbfile and copies it in with one transaction """
+    # Read CSV file into DataFrame
+    df = read_csv(csvfile)
+
+    # Build into a temporary file so the dashboard keeps reading the old
+    # database until the new one is complete
+    tmpfile = dbfile + '.tmp'
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+
+    # Connect to SQLite database
+    conn = sqlite3.connect(tmpfile)
+
+    # bump the data version so the dashboard drops figures cached for the old data
+    version = 0
+    if os.path.exists(dbfile):
+        old = sqlite3.connect(dbfile)
+        version = old.execute("PRAGMA user_version").fetchone()[0]
+        old.close()
+    conn.execute(f"PRAGMA user_version = {version + 1}")
+
+    # WAL lets the dashboard's read-only connections keep reading while
+    # incremental updates write; the mode is stored in the database file
+    conn.execute("PRAGMA journal_mode = WAL")
+
+    # Write DataFrame to SQLite database
+    df.to_sql('sunspot', conn, if_exists='replace', index=False)
+
+    # Covering index for the API's range queries: the Date_Fraction range and the
+    # Daily_Sunspot_Total > -1 filter are both answered from the index alone
+    conn.execute("CREATE INDEX IF NOT EXISTS sunspot_date_total ON sunspot (Date_Fraction, Daily_Sunspot_Total)")
+
+    # Multi-resolution aggregates so long spans never read the daily rows
+    build_pyramid(df, conn)
+
+    conn.execute("ANALYZE")
+    conn.commit()
+
+    # Copy the finished database into dbfile page by page in a single write
+    # transaction, so readers see either the old or the new data. Renaming the
+    # file over a WAL database instead would leave its -wal file behind to be
+    # replayed over the new one.
+    live = sqlite3.connect(dbfile)
+    conn.backup(live)
+    live.close()
+
+    # Close database connection
+    conn.close()
+    os.remove(tmpfile)
+    return len(df)
+
+
+def incremental(csvfile, dbfile, chunksize=10000):
+    """ streams the csv and upserts only new days and provisional days whose Def_prov changed """
+    conn = sqlite3.connect(dbfile)
+    conn.execute("PRAGMA journal_mode = WAL")
+
+    # rows at or before max_date are final unless they are still provisional
+    # (Def_prov = 0); those are the only existing rows that get revisited
+    max_date = conn.execute("SELECT MAX(Date_Fraction) FROM sunspot").fetchone()[0]
+    provisional = dict(conn.execute("SELECT Date_Fraction, Def_prov FROM sunspot WHERE Def_prov = 0"))
+    first_provisional = min(provisional, default=max_date)
+
+    cols = ', '.join(f"{col} = ?" for col in COLUMNS)
+    update = f"UPDATE sunspot SET {cols} WHERE Date_Fraction = ?"
+
+    inserted = updated = 0
+    since_year = None
+
+    # one transaction: readers see either the old or the fully updated data
+    with conn:
+        for chunk in read_csv(csvfile, chunksize=chunksize):
+            # chunks wholly before the first provisional day cannot change anything
+            if chunk['Date_Fraction'].iat[-1] < first_provisional:
+                continue
+
+            new = chunk[chunk['Date_Fraction'] > max_date]
+            old = chunk[chunk['Date_Fraction'] <= max_date]
+            old = old[old['Date_Fraction'].map(provisional).pipe(
+                lambda flag: flag.notna() & (flag != old['Def_prov']))]
+
+            if len(new):
+                insert_rows(conn, 'sunspot', new)
+            if len(old):
+                rows = [row + (row[3],) for row in old.astype(object).itertuples(index=False, name=None)]
+                conn.executemany(update, rows)
+
+            inserted += len(new)
+            updated += len(old)
+            for changed in (new, old):
+                if len(changed):
+                    first = int(changed['Year'].min())
+                    since_year = first if since_year is None else min(since_year, first)
+
+        if since_year is not None:
+            refresh_pyramid(conn, since_year)
+
+            # bump the data version so the dashboard drops figures cached for the old data
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+
+    conn.close()
+    return inserted, updated
+
+
+def write_snapshot(dbfile):
+    """ saves the dashboard's in-memory arrays as memory-mappable .npy files next to dbfile """
+    SunspotAPI.connect(dbfile, in_memory=True)
+    SunspotAPI.save_snapshot()
+    SunspotAPI.pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load the SILSO daily sunspot csv into sunspot.db')
+    parser.add_argument('--csv', default='sunspot.csv')
+    parser.add_argument('--db', default='sunspot.db')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only upsert rows newer than the database or whose Def_prov changed')
+    parser.add_argument('--chunksize', type=int, default=10000)
+    parser.add_argument('--no-snapshot', action='store_true',
+                        help='skip writing the .npy snapshot the dashboard memory-maps at startup')
+    args = parser.parse_args()
+
+    if args.incremental and os.path.exists(args.db):
+        inserted, updated = incremental(args.csv, args.db, args.chunksize)
+        print(f"Incremental update successful! {inserted} rows added, {updated} rows revised")
+    else:
+        rows = full_build(args.csv, args.db)
 
-# Write DataFrame to SQLite database
-df.to_sql('sunspot', conn, if_exists='replace', index=False)
+        # print success message
+        print(f"Conversion successful! {rows} rows")
 
-# Close database connection
-conn.close()
+    if not args.no_snapshot:
+        write_snapshot(args.db)
 
-# print success message
-print("Conversion successful!")
 
+if __name__ == '__main__':
+    main()